@@ -0,0 +1,204 @@
+"""Hot / cold tiering for github events.
+
+Recent events stay in the live github_event table, while whole months
+older than the retention period are moved into compressed, read only
+monthly archive files (in the block cache's column chunk format). The
+reader api yields events across both tiers.
+"""
+from bisect import bisect_left
+from dataclasses import fields
+from datetime import datetime, timedelta
+from itertools import compress
+import json
+import logging
+import os
+from pathlib import Path
+
+import sqlalchemy as rdb
+
+from .cache import decode, decode_columns, encode
+from .github import GithubEvent, month_windows
+
+
+log = logging.getLogger("hubhud.archive")
+
+KeepDays = 90
+
+
+class Archive:
+
+    Manifest = "manifest.json"
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.columns = list(GithubEvent.__table__.columns)
+        self.init_fields = [f.name for f in fields(GithubEvent) if f.init]
+        self.source_columns = [
+            c.name
+            for c in self.columns
+            if c.name not in GithubEvent.__local_fields__
+        ]
+        self.schema = [
+            (c.name, isinstance(c.type, rdb.DateTime) and "DateTime" or "")
+            for c in self.columns
+        ]
+
+    def month_path(self, month: datetime) -> Path:
+        return self.path / month.strftime("github_event-%Y-%m.blk")
+
+    def months(self):
+        return sorted(
+            datetime.strptime(p.name, "github_event-%Y-%m.blk")
+            for p in self.path.glob("github_event-*.blk")
+        )
+
+    def manifest(self) -> dict:
+        p = self.path / self.Manifest
+        if not p.exists():
+            return {}
+        return json.loads(p.read_text())
+
+    def last_created_at(self):
+        """Most recent event time in the archive, for the sync watermark."""
+        last = self.manifest().get("last_created_at")
+        return last and datetime.fromisoformat(last)
+
+    def read_month(self, month):
+        p = self.month_path(month)
+        if not p.exists():
+            return []
+        schema, rows = decode(p.read_bytes())
+        names = [s[0] for s in schema]
+        return [dict(zip(names, r)) for r in rows]
+
+    def event_key(self, row):
+        # ids are local and may be reused once archiving empties the live
+        # table, so events are identified by their source columns.
+        return tuple(
+            tuple(row[name]) if isinstance(row[name], list) else row[name]
+            for name in self.source_columns
+        )
+
+    def write_month(self, month, rows):
+        # merge with any events previously archived for the month, so
+        # rerunning an interrupted archive doesn't duplicate.
+        merged = {self.event_key(r): r for r in self.read_month(month)}
+        merged.update((self.event_key(r), r) for r in rows)
+        rows = sorted(merged.values(), key=lambda r: r["created_at"])
+
+        p = self.month_path(month)
+        tmp = p.with_suffix(".tmp")
+        tmp.write_bytes(
+            encode(self.schema, [[r[name] for name, _ in self.schema] for r in rows])
+        )
+        os.chmod(tmp, 0o444)
+        tmp.replace(p)
+
+        last = self.last_created_at()
+        if rows and (last is None or rows[-1]["created_at"] > last):
+            (self.path / self.Manifest).write_text(
+                json.dumps({"last_created_at": rows[-1]["created_at"].isoformat()})
+            )
+
+    def archive(self, session, keep_days=KeepDays, now=None) -> int:
+        """Move whole months older than keep_days from the live table."""
+        cutoff = (now or datetime.utcnow()) - timedelta(days=keep_days)
+        cutoff = datetime(cutoff.year, cutoff.month, 1)
+        first = session.execute(
+            rdb.select(rdb.func.min(GithubEvent.created_at))
+        ).scalar()
+        if first is None or first >= cutoff:
+            return 0
+
+        count = 0
+        for ms, me in month_windows(first, cutoff):
+            window = (GithubEvent.created_at >= ms, GithubEvent.created_at < me)
+            rows = [
+                dict(r._mapping)
+                for r in session.execute(rdb.select(*self.columns).where(*window))
+            ]
+            if not rows:
+                continue
+            self.write_month(ms, rows)
+            session.execute(rdb.delete(GithubEvent).where(*window))
+            session.commit()
+            count += len(rows)
+            log.info("archived %d events for %s", len(rows), ms.strftime("%Y-%m"))
+        return count
+
+    def events(self, session, start=None, end=None, project=None):
+        """Yield events from the archive and then the live table."""
+        yield from self.archived_events(start, end, project)
+
+        query = rdb.select(GithubEvent).order_by(GithubEvent.created_at)
+        if start:
+            query = query.where(GithubEvent.created_at >= start)
+        if end:
+            query = query.where(GithubEvent.created_at < end)
+        if project:
+            query = query.where(GithubEvent.repo_name == project)
+        yield from session.execute(query).scalars()
+
+    def select_months(self, start=None, end=None):
+        return [
+            month
+            for month in self.months()
+            if not (
+                (end and month >= end) or (start and month + timedelta(days=31) < start)
+            )
+        ]
+
+    def archived_events(self, start=None, end=None, project=None):
+        for month in self.select_months(start, end):
+            for r in self.read_month(month):
+                if (
+                    (start and r["created_at"] < start)
+                    or (end and r["created_at"] >= end)
+                    or (project and r["repo_name"] != project)
+                ):
+                    continue
+                # unmapped fields aren't stored, so default them.
+                e = GithubEvent(**{f: r.get(f) for f in self.init_fields})
+                e.id = r["id"]
+                yield e
+
+    def archived_columns(
+        self, names, start=None, end=None, project=None, event_types=None
+    ):
+        """Read the named columns of archived events as {name: values}.
+
+        Only the chunks for the requested and filtered columns are
+        decompressed, and filters are applied a column at a time, rather
+        than materializing events.
+        """
+        filters = {"created_at"}
+        if project:
+            filters.add("repo_name")
+        if event_types:
+            filters.add("event_type")
+        results = {n: [] for n in names}
+        for month in self.select_months(start, end):
+            _, columns = decode_columns(
+                self.month_path(month).read_bytes(), filters.union(names)
+            )
+            # events are stored in created_at order
+            created = columns["created_at"]
+            lo = bisect_left(created, start) if start else 0
+            hi = bisect_left(created, end) if end else len(created)
+            keep = [lo <= i < hi for i in range(len(created))]
+            if project:
+                keep = [k and r == project for k, r in zip(keep, columns["repo_name"])]
+            if event_types:
+                keep = [
+                    k and t in event_types for k, t in zip(keep, columns["event_type"])
+                ]
+            for n in names:
+                results[n].extend(compress(columns[n], keep))
+        return results
+
+
+def vacuum(engine):
+    """Reclaim space freed by archiving, so the live db file stays bounded."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM")
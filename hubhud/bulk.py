@@ -0,0 +1,131 @@
+"""Bulk loading of synced rows.
+
+On postgresql rows are streamed with COPY into a staging table and merged
+into the target table with a single set-based insert / upsert, other
+databases fall back to executemany.
+"""
+from datetime import datetime
+import io
+import json
+import logging
+
+import sqlalchemy as rdb
+from sqlalchemy.dialects import sqlite
+
+
+log = logging.getLogger("hubhud.bulk")
+
+
+class BulkLoader:
+    """Buffer mapped dataclass instances and write them in batches.
+
+    Tables with a natural primary key are upserted, rows buffered more than
+    once in a batch keep their last value. Tables with a generated identity
+    key are appended to.
+    """
+
+    BatchSize = 10000
+
+    def __init__(self, session, klass, batch_size=None):
+        self.session = session
+        self.table = klass.__table__
+        self.batch_size = batch_size or self.BatchSize
+        self.columns = [c for c in self.table.columns if c.identity is None]
+        self.keys = [c.name for c in self.table.primary_key if c.identity is None]
+        self._buf = {}
+        self.loaded = 0
+
+    def add(self, obj):
+        row = {c.name: getattr(obj, c.name) for c in self.columns}
+        key = self.keys and tuple(row[k] for k in self.keys) or len(self._buf)
+        self._buf[key] = row
+        if len(self._buf) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> int:
+        rows = list(self._buf.values())
+        self._buf = {}
+        if not rows:
+            return 0
+        dialect = self.session.get_bind().dialect.name
+        if dialect == "postgresql":
+            self._copy(rows)
+        else:
+            self._executemany(rows, dialect)
+        self.loaded += len(rows)
+        log.debug("loaded %d rows into %s", len(rows), self.table.name)
+        return len(rows)
+
+    def _executemany(self, rows, dialect):
+        if self.keys and dialect == "sqlite":
+            stmt = sqlite.insert(self.table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=self.keys,
+                set_={
+                    c.name: stmt.excluded[c.name]
+                    for c in self.columns
+                    if c.name not in self.keys
+                },
+            )
+        else:
+            stmt = rdb.insert(self.table)
+        self.session.execute(stmt, rows)
+
+    def _copy(self, rows):
+        cols = ", ".join('"%s"' % c.name for c in self.columns)
+        stage = "stage_%s" % self.table.name
+        merge = 'INSERT INTO "%s" (%s) SELECT %s FROM %s' % (
+            self.table.name,
+            cols,
+            cols,
+            stage,
+        )
+        if self.keys:
+            merge += " ON CONFLICT (%s) DO UPDATE SET %s" % (
+                ", ".join('"%s"' % k for k in self.keys),
+                ", ".join(
+                    '"%s" = EXCLUDED."%s"' % (c.name, c.name)
+                    for c in self.columns
+                    if c.name not in self.keys
+                ),
+            )
+
+        cursor = self.session.connection().connection.cursor()
+        try:
+            cursor.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS %s ON COMMIT DELETE ROWS AS "
+                'SELECT %s FROM "%s" WITH NO DATA' % (stage, cols, self.table.name)
+            )
+            cursor.execute("TRUNCATE %s" % stage)
+            cursor.copy_expert(
+                "COPY %s (%s) FROM STDIN WITH (FORMAT csv)" % (stage, cols),
+                io.StringIO("".join(csv_line(row, self.columns) for row in rows)),
+            )
+            cursor.execute(merge)
+        finally:
+            cursor.close()
+
+
+def csv_line(row, columns) -> str:
+    return ",".join(csv_value(row[c.name], c.type) for c in columns) + "\n"
+
+
+def csv_value(value, ctype) -> str:
+    # unquoted empty is null in copy's csv format, quoted empty is ''.
+    if value is None:
+        return ""
+    # unwrap sqlite variants and type decorators
+    ctype = getattr(ctype, "impl", ctype)
+    if isinstance(ctype, rdb.ARRAY):
+        value = "{%s}" % ",".join(
+            '"%s"' % str(v).replace("\\", "\\\\").replace('"', '\\"') for v in value
+        )
+    elif isinstance(ctype, rdb.JSON):
+        value = json.dumps(value)
+    elif isinstance(value, bool):
+        value = value and "t" or "f"
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return '"%s"' % value.replace('"', '""')
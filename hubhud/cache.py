@@ -0,0 +1,102 @@
+"""Local on-disk cache of clickhouse result blocks.
+
+Each block holds one (project, window, schema hash) result set as
+compressed column chunks, along with the clickhouse column names and
+types needed to decode them.
+"""
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import zlib
+
+
+log = logging.getLogger("hubhud.cache")
+
+
+class BlockCache:
+
+    MaxBytes = 2 * 1024**3
+    Suffix = ".blk"
+
+    def __init__(self, path, max_bytes=None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes or self.MaxBytes
+
+    def key_path(self, project: str, window: str, schema_hash: str) -> Path:
+        pdir = hashlib.sha1(project.encode("utf8")).hexdigest()[:16]
+        return self.path / pdir / ("%s-%s%s" % (window, schema_hash, self.Suffix))
+
+    def get(self, project, window, schema_hash):
+        """Return (schema, rows) for a cached block, or None on a miss."""
+        p = self.key_path(project, window, schema_hash)
+        try:
+            data = p.read_bytes()
+        except FileNotFoundError:
+            return None
+        # bump the modification time, eviction is least recently used first.
+        os.utime(p)
+        return decode(data)
+
+    def put(self, project, window, schema_hash, schema, rows):
+        p = self.key_path(project, window, schema_hash)
+        p.parent.mkdir(exist_ok=True)
+        tmp = p.with_suffix(".tmp")
+        tmp.write_bytes(encode(schema, rows))
+        tmp.replace(p)
+        self.evict()
+
+    def size(self) -> int:
+        return sum(p.stat().st_size for p in self.path.rglob("*" + self.Suffix))
+
+    def evict(self):
+        blocks = [(p.stat(), p) for p in self.path.rglob("*" + self.Suffix)]
+        total = sum(s.st_size for s, _ in blocks)
+        if total <= self.max_bytes:
+            return
+        for s, p in sorted(blocks, key=lambda b: b[0].st_mtime):
+            p.unlink()
+            total -= s.st_size
+            log.debug("evicted block %s", p)
+            if total <= self.max_bytes:
+                break
+
+
+def encode(schema, rows) -> bytes:
+    columns = [list(c) for c in zip(*rows)] or [[] for _ in schema]
+    chunks = []
+    for (name, ctype), values in zip(schema, columns):
+        if "DateTime" in ctype:
+            values = [v and v.isoformat() for v in values]
+        chunks.append(zlib.compress(json.dumps(values).encode("utf8")))
+    header = json.dumps(
+        {"schema": schema, "chunks": [len(c) for c in chunks]}
+    ).encode("utf8")
+    return b"".join([len(header).to_bytes(4, "little"), header] + chunks)
+
+
+def decode(data: bytes):
+    schema, columns = decode_columns(data)
+    return schema, list(zip(*columns.values()))
+
+
+def decode_columns(data: bytes, names=None):
+    """Decode a block into {name: values}, optionally only the named
+    columns, in which case the other chunks aren't decompressed."""
+    hlen = int.from_bytes(data[:4], "little")
+    offset = 4 + hlen
+    header = json.loads(data[4:offset])
+    columns = {}
+    for (name, ctype), clen in zip(header["schema"], header["chunks"]):
+        end = offset + clen
+        if names is None or name in names:
+            values = json.loads(zlib.decompress(data[offset:end]))
+            if "DateTime" in ctype:
+                values = [v and datetime.fromisoformat(v) for v in values]
+            columns[name] = values
+        offset = end
+    schema = [tuple(s) for s in header["schema"]]
+    return schema, columns
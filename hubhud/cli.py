@@ -1,25 +1,33 @@
+"""Command line interface.
+
+Source and backend modules pull in heavy dependencies (sqlalchemy,
+clickhouse, tantivy, numpy, boto3), so commands import them when invoked
+rather than at module load. Plugin commands are resolved lazily through
+the registry.
+"""
+from contextlib import contextmanager
+import json
 import logging
 import time
 
 import click
-from sqlalchemy.orm import Session
 
-from .github import sync as github_sync
-from .gitter import sync as gitter_sync
+from .registry import COMMANDS, SOURCES, LazyGroup
 
-try:
-    from .search import index as search_index
-    from .search import search as query_index
-except ImportError:
-    search_index = None
-    query_index = None
+log = logging.getLogger("hubhud")
 
-from .schema import get_db
 
-log = logging.getLogger("hubhud")
+@contextmanager
+def db_session(db):
+    from sqlalchemy.orm import Session
+    from .schema import get_db
 
+    engine = get_db(db)
+    with Session(engine) as s:
+        yield s
 
-@click.group()
+
+@click.group(cls=LazyGroup, plugins=COMMANDS)
 def cli():
     """HubHud - Tracking Github"""
     logging.basicConfig(
@@ -35,14 +43,19 @@ def search():
 @search.command()
 @click.option("-i", "--index", type=click.Path(), required=True)
 @click.option("-q", "--query", required=True)
-def query(index, query):
+@click.option("-p", "--project", multiple=True, help="limit to project shards")
+@click.option("-y", "--year", type=int, multiple=True, help="limit to year shards")
+@click.option("-n", "--limit", type=int, default=10)
+def query(index, query, project, year, limit):
+    from .search import search as query_index
 
     t = time.time()
-    results = query_index(index, query)
+    results = query_index(index, query, limit, project, year)
     log.info("queried messages in %0.2f", time.time() - t)
     for r in results:
         print((
             f"score: {r['score']}"
+            f" project: {r['doc']['project'][0]}"
             f" sent: {r['doc']['sent'][0]}"
             f" author: {r['doc']['author'][0]}"
             f" body:\n{r['doc']['body'][0]}\n"
@@ -52,15 +65,99 @@ def query(index, query):
 @search.command()
 @click.option("-f", "--db", envvar="HUD_DB", required=True)
 @click.option("-i", "--index", type=click.Path(), required=True)
-def index(db, index):
+@click.option("-p", "--project", multiple=True, help="only rebuild these projects")
+@click.option("-y", "--year", type=int, multiple=True, help="only rebuild these years")
+@click.option("--by-year", is_flag=True, help="shard projects by year")
+def index(db, index, project, year, by_year):
+    from .search import index as search_index
+
+    if year and not by_year:
+        raise click.UsageError("--year requires --by-year")
     log.info("indexing messages for search")
-    engine = get_db(db)
-    with Session(engine) as s:
-        count = search_index(s, index)
+    with db_session(db) as s:
+        try:
+            count = search_index(s, index, project, year, by_year)
+        except ValueError as e:
+            raise click.UsageError(str(e))
     log.info("finished - indexed %d messages", count)
 
 
-@cli.group()
+@search.command()
+@click.option("-f", "--db", envvar="HUD_DB", required=True)
+@click.option("--id", "message_id", required=True)
+@click.option("-t", "--threshold", type=float, default=0.5)
+@click.option("-n", "--limit", type=int, default=10)
+def similar(db, message_id, threshold, limit):
+    """Find near duplicates of a message"""
+    from .gitter import get_thread
+    from .similar import SimilarityIndex
+
+    with db_session(db) as s:
+        t = time.time()
+        results = SimilarityIndex(s).similar(message_id, threshold, limit)
+        log.info("found %d similar messages in %0.2f", len(results), time.time() - t)
+        for mid, score in results:
+            thread = get_thread(s, mid)
+            for m in thread:
+                indent = m.parent and "    " or ""
+                if not m.parent:
+                    print(f"similarity: {score:0.2f} id: {m.id}")
+                print(f"{indent}sent: {m.sent} author: {m.author}")
+                print(f"{indent}{m.text}\n")
+
+
+@search.command()
+@click.option("-f", "--db", envvar="HUD_DB", required=True)
+@click.option("-p", "--project", envvar="HUB_PROJECT")
+@click.option("-t", "--threshold", type=float, default=0.5)
+@click.option("--rebuild", is_flag=True, help="rebuild the similarity index first")
+def cluster(db, project, threshold, rebuild):
+    """Cluster near duplicate messages as json"""
+    import sqlalchemy as rdb
+    from .gitter import Message
+    from .similar import SimilarityIndex
+
+    with db_session(db) as s:
+        index = SimilarityIndex(s)
+        if rebuild:
+            query = rdb.select(Message).where(Message.parent.is_(None))
+            if project:
+                query = query.filter_by(project=project)
+            count = index.rebuild(s.execute(query).scalars())
+            s.commit()
+            log.info("indexed %d messages", count)
+        clusters = index.cluster(project, threshold)
+        print(json.dumps(
+            [
+                {"size": len(c), "ids": c, "text": s.get(Message, c[0]).text}
+                for c in clusters
+            ],
+            indent=2,
+        ))
+
+
+@cli.command()
+@click.option("-f", "--db", envvar="HUD_DB", required=True)
+@click.option("-p", "--project", envvar="HUB_PROJECT", required=True)
+@click.option("--since", type=click.DateTime(), help="only consider events since")
+@click.option("--archive", envvar="HUB_ARCHIVE", type=click.Path(), help="archive dir")
+def metrics(db, project, since, archive):
+    """Issue and pull request lifecycle metrics as json"""
+    from .metrics import metrics as project_metrics
+
+    if archive:
+        from .archive import Archive
+
+        archive = Archive(archive)
+
+    t = time.time()
+    with db_session(db) as s:
+        results = project_metrics(s, project, since, archive)
+    log.info("computed metrics in %0.2f", time.time() - t)
+    print(json.dumps(results, indent=2))
+
+
+@cli.group(cls=LazyGroup, plugins=SOURCES)
 def sync():
     """Sync information sources to local database"""
 
@@ -68,26 +165,72 @@ def sync():
 @sync.command()
 @click.option("-f", "--db", envvar="HUD_DB", required=True)
 @click.option("-p", "--project", envvar="HUB_PROJECT", required=True)
-def gitter(db, project):
+@click.option("--stream", envvar="HUB_FIREHOSE", help="publish changes to firehose")
+@click.option("--endpoint", envvar="HUB_FIREHOSE_ENDPOINT")
+@click.option("--similar/--no-similar", default=True, help="maintain duplicate index")
+def gitter(db, project, stream, endpoint, similar):
+    from .gitter import sync as gitter_sync
+
+    if similar:
+        from .similar import SimilarityIndex
+
     log.info("syncing gitter messages for %s", project)
-    engine = get_db(db)
-    with Session(engine) as s:
-        count = gitter_sync(s, project)
+    with db_session(db) as s:
+        publisher = None
+        if stream:
+            from .firehose import FirehosePublisher, get_client as get_firehose
+
+            publisher = FirehosePublisher(s, project, stream, get_firehose(endpoint))
+        count = gitter_sync(
+            s, project, publisher, similar and SimilarityIndex(s) or None
+        )
     log.info("finished - added %d messages for %s", count, project)
 
 
+@sync.command()
+@click.option("-f", "--db", envvar="HUD_DB", required=True)
+@click.option("-p", "--project", envvar="HUB_PROJECT", required=True)
+@click.option("--stream", envvar="HUB_FIREHOSE", default="gitter-s3-archive")
+@click.option("--endpoint", envvar="HUB_FIREHOSE_ENDPOINT")
+def firehose(db, project, stream, endpoint):
+    """Publish stored messages since the last checkpoint to firehose"""
+    from .firehose import get_client as get_firehose, publish
+
+    log.info("publishing gitter messages for %s to %s", project, stream)
+    with db_session(db) as s:
+        count = publish(s, project, stream, get_firehose(endpoint))
+    log.info("finished - published %d messages for %s", count, project)
+
+
 @sync.command()
 @click.option("-f", "--db", envvar="HUD_DB", required=True)
 @click.option("-p", "--project", envvar="HUB_PROJECT", required=True)
 @click.option("--rename")
-def github(db, project, rename):
+@click.option("--cache", envvar="HUB_CACHE", type=click.Path(), help="block cache dir")
+@click.option("--cache-size", type=int, help="max cache size in MiB")
+@click.option(
+    "--archive", envvar="HUB_ARCHIVE", type=click.Path(), help="archive old events"
+)
+@click.option("--keep-days", type=int, default=90, help="days of events kept live")
+def github(db, project, rename, cache, cache_size, archive, keep_days):
     """Sync github events for a project into the db"""
-    log.info("syncing github events for %s", project)
-    engine = get_db(db)
-    with Session(engine) as s:
-        count = github_sync(s, project, rename)
+    from .archive import Archive, vacuum
+    from .cache import BlockCache
+    from .github import sync as github_sync
 
-    log.info("finished - added %d events for %s", count, project)
+    log.info("syncing github events for %s", project)
+    if cache:
+        cache = BlockCache(cache, cache_size and cache_size * 1024**2)
+    if archive:
+        archive = Archive(archive)
+    with db_session(db) as s:
+        count = github_sync(s, project, rename, cache, archive)
+        log.info("finished - added %d events for %s", count, project)
+        if archive:
+            archived = archive.archive(s, keep_days)
+            if archived:
+                vacuum(s.get_bind())
+            log.info("archived %d events older than %d days", archived, keep_days)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,186 @@
+"""Publish gitter messages to the kinesis firehose stream provisioned in
+module/kinesis.tf, which delivers into elasticsearch and s3.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import logging
+import time
+
+import boto3
+import sqlalchemy as rdb
+
+from .gitter import Message
+from .schema import mapper_registry, F
+
+
+log = logging.getLogger("hubhud.firehose")
+
+DEFAULT_STREAM = "gitter-s3-archive"
+
+
+@mapper_registry.mapped
+@dataclass
+class FirehoseCheckpoint:
+
+    __tablename__ = "firehose_checkpoint"
+    __sa_dataclass_metadata_key__ = "sa"
+
+    # Delivery stream name
+    stream: str = F(rdb.Column(rdb.String, primary_key=True))
+    # Github project the messages belong to
+    project: str = F(rdb.Column(rdb.String, primary_key=True))
+    # Last message delivered
+    last_id: str = F(rdb.String, None)
+    # Most recent sent / edited time delivered
+    last_sent: datetime = F(rdb.DateTime, None)
+    # Total records delivered
+    published: int = F(rdb.Integer, 0)
+    updated_at: datetime = F(rdb.DateTime, None)
+
+
+def get_client(endpoint=None):
+    return boto3.client("firehose", endpoint_url=endpoint)
+
+
+def serialize(m: Message) -> bytes:
+    doc = {
+        "id": m.id,
+        "project": m.project,
+        "author": m.author,
+        "parent": m.parent,
+        "sent": m.sent and m.sent.isoformat(),
+        "editedAt": m.editedAt and m.editedAt.isoformat(),
+        "threadMessageCount": m.threadMessageCount,
+        "text": m.text,
+        "html": m.html,
+    }
+    # firehose concatenates records in the s3 backup, so newline delimit them.
+    return (json.dumps(doc) + "\n").encode("utf8")
+
+
+class FirehosePublisher:
+    """Batch messages into PutRecordBatch calls within the service limits.
+
+    Records are buffered with `add` and delivered on `flush`, which also
+    advances the checkpoint in the caller's session, so delivery progress is
+    committed along with the messages themselves.
+    """
+
+    MaxBatchRecords = 500
+    MaxBatchBytes = 4 * 1024 * 1024
+    MaxRecordBytes = 1000 * 1024
+    MaxAttempts = 5
+    retry_interval = 0.5
+
+    def __init__(self, session, project: str, stream=DEFAULT_STREAM, client=None):
+        self.session = session
+        self.project = project
+        self.stream = stream
+        self.client = client or get_client()
+        self.checkpoint = self.get_checkpoint()
+        self._buf = []
+        self._last = None
+
+    def get_checkpoint(self) -> FirehoseCheckpoint:
+        cp = self.session.get(FirehoseCheckpoint, (self.stream, self.project))
+        if cp is None:
+            cp = FirehoseCheckpoint(stream=self.stream, project=self.project)
+            self.session.add(cp)
+        return cp
+
+    def add(self, m: Message):
+        record = serialize(m)
+        if len(record) > self.MaxRecordBytes:
+            log.warning(
+                "skipping message %s size %d over firehose record limit",
+                m.id,
+                len(record),
+            )
+            return
+        self._buf.append(record)
+        # checkpoint on (time, id) so messages sharing a timestamp are ordered.
+        position = (m.editedAt or m.sent, m.id)
+        if self._last is None or position > self._last:
+            self._last = position
+
+    def flush(self) -> int:
+        count = 0
+        for batch in self.batches(self._buf):
+            self.put(batch)
+            count += len(batch)
+        self._buf = []
+
+        if count:
+            cp = self.checkpoint
+            cp.published = (cp.published or 0) + count
+            if cp.last_sent is None or self._last > (cp.last_sent, cp.last_id):
+                cp.last_sent, cp.last_id = self._last
+            cp.updated_at = datetime.utcnow()
+            log.info("published %d records to %s", count, self.stream)
+        self._last = None
+        return count
+
+    def batches(self, records):
+        batch, size = [], 0
+        for r in records:
+            if batch and (
+                len(batch) == self.MaxBatchRecords
+                or size + len(r) > self.MaxBatchBytes
+            ):
+                yield batch
+                batch, size = [], 0
+            batch.append(r)
+            size += len(r)
+        if batch:
+            yield batch
+
+    def put(self, batch):
+        pending = batch
+        for attempt in range(self.MaxAttempts):
+            response = self.client.put_record_batch(
+                DeliveryStreamName=self.stream,
+                Records=[{"Data": r} for r in pending],
+            )
+            if not response["FailedPutCount"]:
+                return
+            # only resend the records firehose rejected
+            pending = [
+                r
+                for r, rr in zip(pending, response["RequestResponses"])
+                if rr.get("ErrorCode")
+            ]
+            log.info(
+                "retrying %d failed records to %s attempt:%d",
+                len(pending),
+                self.stream,
+                attempt + 1,
+            )
+            time.sleep(self.retry_interval * 2**attempt)
+        raise RuntimeError(
+            "firehose %s failed to deliver %d records" % (self.stream, len(pending))
+        )
+
+
+def publish(session, project: str, stream=DEFAULT_STREAM, client=None) -> int:
+    """Publish stored messages sent or edited since the stream's checkpoint."""
+    publisher = FirehosePublisher(session, project, stream, client)
+    since, last_id = publisher.checkpoint.last_sent, publisher.checkpoint.last_id
+
+    query = rdb.select(Message).filter_by(project=project)
+    mtime = rdb.func.coalesce(Message.editedAt, Message.sent)
+    if since:
+        query = query.where(
+            rdb.or_(mtime > since, rdb.and_(mtime == since, Message.id > last_id))
+        )
+
+    count = 0
+    for r in session.execute(query.order_by(mtime, Message.id)):
+        publisher.add(r[0])
+        count += 1
+        if count % publisher.MaxBatchRecords == 0:
+            publisher.flush()
+            session.commit()
+    publisher.flush()
+    session.commit()
+    return count
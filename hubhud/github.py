@@ -2,15 +2,17 @@
 https://ghe.clickhouse.tech
 """
 from dataclasses import dataclass, field, fields
-from datetime import datetime
+from datetime import datetime, timedelta
 import difflib
+import hashlib
 from enum import Enum
 import logging
 
-from clickhouse_driver import Client
 import sqlalchemy as rdb
 
-from .schema import mapper_registry, F, Array
+from .bulk import BulkLoader
+from .people import People, backfill
+from .schema import mapper_registry, migration, F, Array
 
 
 log = logging.getLogger("hubhud.github")
@@ -117,6 +119,8 @@ class ReviewType(Enum):
 class GithubEvent:
     __tablename__ = "github_event"
     __sa_dataclass_metadata_key__ = "sa"
+    # don't reuse ids once archiving empties the table
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id: int = field(
         init=False,
@@ -130,7 +134,7 @@ class GithubEvent:
     event_type: str = F(rdb.String(30))  # todo enum
     actor_login: str = F(rdb.String(64))
     repo_name: str = F(rdb.String(256))
-    created_at: datetime = F(rdb.DateTime)
+    created_at: datetime = F(rdb.Column(rdb.DateTime, index=True))
     updated_at: datetime = F(rdb.DateTime)
     action: str = F(rdb.String(32))  # todo enum
     comment_id: int = F(rdb.BigInteger)
@@ -181,8 +185,46 @@ class GithubEvent:
     release_name: F(rdb.String, None)
     review_state: F(rdb.String, None)  # todo enum
 
+    # people identities, maintained locally rather than sourced from clickhouse
+    actor_id: int = F(
+        rdb.Column(rdb.Integer, rdb.ForeignKey("people.id"), index=True), None
+    )
+    creator_id: int = F(rdb.Column(rdb.Integer, rdb.ForeignKey("people.id")), None)
+    merged_by_id: int = F(rdb.Column(rdb.Integer, rdb.ForeignKey("people.id")), None)
+
+    __local_fields__ = ("id", "actor_id", "creator_id", "merged_by_id")
+
+
+@migration("github_people")
+def backfill_people(session):
+    backfill(
+        session,
+        GithubEvent.actor_login,
+        GithubEvent.actor_id,
+        GithubEvent.created_at,
+        "events",
+    )
+    backfill(session, GithubEvent.creator_user_login, GithubEvent.creator_id)
+
 
-def get_events(project, start=None, end=None, limit=0, direction=""):
+def get_events(project, start=None, end=None, limit=0, direction="", cache=None):
+    if cache is not None and not limit and direction != "desc":
+        blocks = cached_events(cache, project, start, end)
+    else:
+        blocks = [query_events(project, start, end, limit, direction)]
+
+    for schema, rows in blocks:
+        snames = check_schema_diff(GithubEvent, schema)
+        for r in rows:
+            # convert to dict, because we reorder to handle null fields coming back
+            # from db.
+            yield GithubEvent(**dict(zip(snames, r)))
+
+
+def query_events(
+    project, start=None, end=None, limit=0, direction="", start_inclusive=False
+):
+    """Query clickhouse returning the column schema and a row iterator."""
     client = get_client()
     query = """
     select *
@@ -190,7 +232,7 @@ def get_events(project, start=None, end=None, limit=0, direction=""):
     where repo_name = %(project)s
     """
     if start:
-        query += " and created_at > %(start)s"
+        query += " and created_at %s %%(start)s" % (start_inclusive and ">=" or ">")
     if end:
         query += " and created_at < %(end)s"
 
@@ -212,16 +254,93 @@ def get_events(project, start=None, end=None, limit=0, direction=""):
         query, params, settings={"block_size": block_size}, with_column_types=True
     )
     schema = next(results_iter)
-    snames = check_schema_diff(GithubEvent, schema)
+    return schema, results_iter
+
+
+# clickhouse ingests events with some lag, so only treat a month as closed
+# once it has been over for a while.
+ClosedAfter = timedelta(days=2)
 
-    for r in results_iter:
-        # convert to dict, because we reorder to handle null fields coming back from db.
-        yield GithubEvent(**dict(zip(snames, r)))
+
+def month_windows(first, last):
+    ws = datetime(first.year, first.month, 1)
+    while ws < last:
+        we = (ws + timedelta(days=32)).replace(day=1)
+        yield ws, we
+        ws = we
+
+
+def schema_hash():
+    local = GithubEvent.__local_fields__
+    names = [f.name for f in fields(GithubEvent) if f.name not in local]
+    return hashlib.sha1(",".join(names).encode("utf8")).hexdigest()[:12]
+
+
+def first_event(cache, project, shash):
+    block = cache.get(project, "first", shash)
+    # earlier versions cached the epoch for projects without events.
+    if block is not None and block[1][0][0].year >= 2000:
+        return block[1][0][0]
+    rows = get_client().execute(
+        "select min(created_at) from github_events where repo_name = %(project)s",
+        {"project": project},
+    )
+    first = rows[0][0]
+    # clickhouse returns the epoch for min over no rows, don't cache that as
+    # the project may have events later.
+    if first.year < 2000:
+        return None
+    cache.put(project, "first", shash, [("created_at", "DateTime")], rows)
+    return first
+
+
+def cached_events(cache, project, start=None, end=None):
+    """Yield (schema, rows) per monthly window, serving closed months from
+    the block cache and only querying clickhouse for misses and the open
+    window.
+    """
+    shash = schema_hash()
+    first = start or first_event(cache, project, shash)
+    if first is None:
+        return
+    closed = datetime.utcnow() - ClosedAfter
+
+    for ws, we in month_windows(first, end or datetime.utcnow()):
+        if we > closed:
+            if start and start >= ws:
+                yield query_events(project, start, end, direction="asc")
+            else:
+                yield query_events(
+                    project, ws, end, direction="asc", start_inclusive=True
+                )
+            return
+
+        window = ws.strftime("%Y%m")
+        block = cache.get(project, window, shash)
+        if block is None:
+            log.info("caching events for %s %s", project, window)
+            schema, rows = query_events(
+                project, ws, we, direction="asc", start_inclusive=True
+            )
+            rows = list(rows)
+            cache.put(project, window, shash, schema, rows)
+        else:
+            schema, rows = block
+
+        if (start and start >= ws) or (end and end < we):
+            idx = [s[0] for s in schema].index("created_at")
+            rows = [
+                r
+                for r in rows
+                if (not start or r[idx] > start) and (not end or r[idx] < end)
+            ]
+        yield schema, rows
 
 
 def check_schema_diff(klass, schema):
     snames = [s[0] for s in schema]
-    knames = [f.name for f in fields(klass) if f.name != "id"]
+    local = getattr(klass, "__local_fields__", ("id",))
+    knames = [f.name for f in fields(klass) if f.name not in local]
 
     if snames == knames:
         return snames
@@ -232,6 +351,9 @@ def check_schema_diff(klass, schema):
 
 
 def get_client():
+    # only needed to sync, not for reading stored events.
+    from clickhouse_driver import Client
+
     return Client(
         secure=True,
         user="explorer",
@@ -239,23 +361,28 @@ def get_client():
     )
 
 
-def sync(session, project: str, rename: str):
-    last = (
-        session.query(GithubEvent)
-        .order_by(rdb.desc(GithubEvent.created_at))
-        .limit(1)
-        .one_or_none()
-    )
+def sync(session, project: str, rename: str, cache=None, archive=None):
+    last = session.execute(rdb.select(rdb.func.max(GithubEvent.created_at))).scalar()
+    if archive is not None:
+        archived = archive.last_created_at()
+        if archived and (last is None or archived > last):
+            last = archived
     params = {}
     if last:
-        params["start"] = last.created_at
+        params["start"] = last
     count = 0
-    for e in get_events(project, **params):
+    people = People(session)
+    loader = BulkLoader(session, GithubEvent)
+    for e in get_events(project, cache=cache, **params):
         if rename:
             e.repo_name = rename
-        session.add(e)
+        e.actor_id = people.observe(e.actor_login, e.created_at, events=1)
+        e.creator_id = people.resolve(e.creator_user_login)
+        e.merged_by_id = people.resolve(e.merged_by)
+        loader.add(e)
         count += 1
         if count % 1000 == 0:
             log.info("added %d events for %s", count, project)
+    loader.flush()
     session.commit()
     return count
@@ -10,7 +10,9 @@ from urllib.parse import urlencode
 from dateutil.parser import parse as parse_date
 import sqlalchemy as rdb
 
-from .schema import mapper_registry, F, Array, ISODate
+from .bulk import BulkLoader
+from .people import People, backfill
+from .schema import mapper_registry, migration, F, Array, ISODate
 
 
 TOKEN_PARAMETER = os.environ.get("GITTER_TOKEN")
@@ -128,9 +130,13 @@ class Message:
     # If message was edited
     editedAt: str = F(ISODate, None)
     # if message is in subthread
-    parent: str = F(rdb.String, None)
+    parent: str = F(rdb.Column(rdb.String, index=True), None)
     # extract author username from fromUser
     author: str = F(rdb.String, None)
+    # people identity of the author
+    author_id: int = F(
+        rdb.Column(rdb.Integer, rdb.ForeignKey("people.id"), index=True), None
+    )
 
     @classmethod
     def new(cls, data):
@@ -155,6 +161,90 @@ class Message:
         return results
 
 
+@migration("gitter_people")
+def backfill_people(session):
+    backfill(session, Message.author, Message.author_id, Message.sent, "messages")
+
+
+@mapper_registry.mapped
+@dataclass
+class Thread:
+    """Materialized summary of a threaded conversation, keyed by parent id."""
+
+    __tablename__ = "gitter_threads"
+    __sa_dataclass_metadata_key__ = "sa"
+
+    # ID of the parent message.
+    id: str = F(rdb.Column(rdb.String, primary_key=True))
+    # Track which github project we're referencing
+    project: str = F(rdb.String)
+    # Author of the parent message
+    author: str = F(rdb.String, None)
+    # When the parent message was sent.
+    sent: str = F(ISODate, None)
+    # Number of replies stored, compared against the parent's
+    # threadMessageCount to decide if a thread needs refetching.
+    reply_count: int = F(rdb.Integer, 0)
+    # When the most recent reply was sent.
+    last_reply: str = F(ISODate, None)
+
+
+def get_thread(session, parent_id: str) -> list[Message]:
+    """Load a parent message and all of its replies in sent order."""
+    return [
+        r[0]
+        for r in session.execute(
+            rdb.select(Message)
+            .where(rdb.or_(Message.id == parent_id, Message.parent == parent_id))
+            .order_by(Message.sent)
+        )
+    ]
+
+
+def update_thread(session, m: Message):
+    """Track the thread a message starts or replies to, returning its id.
+
+    Reply counts aren't taken from the advertised threadMessageCount, see
+    `count_replies`.
+    """
+    if m.parent:
+        thread = session.get(Thread, m.parent)
+        if thread is not None and (
+            thread.last_reply is None or m.sent > thread.last_reply
+        ):
+            thread.last_reply = m.sent
+        return m.parent
+    if not m.threadMessageCount:
+        return
+    thread = session.get(Thread, m.id)
+    if thread is None:
+        thread = Thread(id=m.id, project=m.project, author=m.author, sent=m.sent)
+        session.add(thread)
+    return m.id
+
+
+def count_replies(session, thread_ids):
+    """Set the reply count of threads from the replies actually stored.
+
+    Must be called after replies are written, so a commit landing part way
+    through a thread records a partial count, and the thread is refetched
+    on the next sync.
+    """
+    if not thread_ids:
+        return
+    counts = dict(
+        session.execute(
+            rdb.select(Message.parent, rdb.func.count())
+            .where(Message.parent.in_(thread_ids))
+            .group_by(Message.parent)
+        ).all()
+    )
+    for tid in thread_ids:
+        thread = session.get(Thread, tid)
+        if thread is not None:
+            thread.reply_count = counts.get(tid, 0)
+
+
 @dataclass
 class User:
     # Gitter User ID.
@@ -176,11 +266,16 @@ class MessageIterator(object):
     Forward = (-1, "afterId")
     Backward = (-1, "beforeId")
     BatchSize = 100
+    ThreadBatchSize = 50
 
     _date_field = operator.itemgetter("sent")
 
-    def __init__(self, client, room: Room, direction=None, lastSeen=None):
+    def __init__(
+        self, client, room: Room, direction=None, lastSeen=None, thread_counts=None
+    ):
         self.client = client
+        # callable returning the number of replies stored for a parent id
+        self.thread_counts = thread_counts
         self.room = room
         self.params = {"roomId": self.room.id, "limit": self.BatchSize}
         self.project = room.uri
@@ -203,8 +298,10 @@ class MessageIterator(object):
             for m in self._buf:
                 m["project"] = self.project
                 m = Message.new(m)
+                # check stored counts before the caller sees the parent.
+                stored = self.thread_counts and self.thread_counts(m.id) or 0
                 yield m
-                for t in self.iter_thread(m):
+                for t in self.iter_thread(m, stored):
                     t["project"] = self.project
                     yield Message.new(t)
             if not self._buf:
@@ -212,15 +309,20 @@ class MessageIterator(object):
             self.params[self.dir_key] = self._buf[self.dir_index]["id"]
             self._buf = None
 
-    def iter_thread(self, m):
-        if not m.threadMessageCount:
+    def iter_thread(self, m, stored=0):
+        # only fetch threads that have grown since we last stored them.
+        if not m.threadMessageCount or m.threadMessageCount <= stored:
             return
-        # its possible we can lose some messages for deep > 50
-        # threads without pagination here. in practice these are
-        # very rare, like we have one in five years (38k threads)
 
-        # threads come in as a tail follow
-        thread = self.client.message_thread(self.room.id, m.id)
+        # threads come in as a tail follow, so page backwards for deep threads.
+        params = {"limit": self.ThreadBatchSize}
+        thread = []
+        while True:
+            batch = self.client.message_thread(self.room.id, m.id, **params)
+            thread[:0] = batch
+            if len(batch) < self.ThreadBatchSize or len(thread) >= m.threadMessageCount:
+                break
+            params["beforeId"] = batch[0]["id"]
         for t in thread:
             yield t
 
@@ -266,9 +368,14 @@ class GitterClient(object):
         response = self._request("/rooms/%s/chatMessages" % roomId, **params)
         return response
 
-    def message_thread(self, roomId, parentId):
+    def message_thread(self, roomId, parentId, beforeId=None, limit=None):
+        params = {}
+        if beforeId:
+            params["beforeId"] = beforeId
+        if limit:
+            params["limit"] = limit
         response = self._request(
-            "/rooms/%s/chatMessages/%s/thread" % (roomId, parentId)
+            "/rooms/%s/chatMessages/%s/thread" % (roomId, parentId), **params
         )
         return response
 
@@ -300,17 +407,29 @@ class GitterClient(object):
         return r.json()
 
 
-def get_messages(client: GitterClient, room: Room, since=None) -> Iterator[Message]:
+def get_messages(
+    client: GitterClient, room: Room, since=None, thread_counts=None
+) -> Iterator[Message]:
     direction = since and MessageIterator.Forward or MessageIterator.Backward
-    for m in MessageIterator(client, room, direction=direction, lastSeen=since):
+    for m in MessageIterator(
+        client, room, direction=direction, lastSeen=since, thread_counts=thread_counts
+    ):
         yield m
 
 
+def stored_thread_counts(session):
+    def thread_count(parent_id):
+        thread = session.get(Thread, parent_id)
+        return thread and thread.reply_count or 0
+
+    return thread_count
+
+
 def update(cur, new):
     pass
 
 
-def sync(session, project: str) -> int:
+def sync(session, project: str, publisher=None, similar=None) -> int:
 
     # sync everything, we have to walk pointers from latest to oldest, which
     # means we'll be layering in to storage new, new-1,.. old.. when we
@@ -332,18 +451,29 @@ def sync(session, project: str) -> int:
     count = 0
     earliest, latest = None, None
     time_buffer = time.time()
+    people = People(session)
+    loader = BulkLoader(session, Message)
+    threads = set()
+
+    for m in get_messages(client, room, since, stored_thread_counts(session)):
+        threads.add(update_thread(session, m))
 
-    for m in get_messages(client, room, since):
         # check if we're updating an existing message
         o = session.get(Message, m.id)
+        m.author_id = people.observe(m.author, m.sent, messages=int(o is None))
         if o is not None:
             if o != m:
                 o.update(m)
                 m = o
             else:
                 continue
+        else:
+            loader.add(m)
 
-        session.add(m)
+        if publisher is not None:
+            publisher.add(m)
+        if similar is not None:
+            similar.add(m)
 
         # bookeeping for logs
         if earliest and m.sent < earliest.sent:
@@ -362,9 +492,18 @@ def sync(session, project: str) -> int:
                 "sync from %s to %s in %0.2f"
                 % (earliest.sent, latest.sent, time.time() - time_buffer)
             )
+            loader.flush()
+            count_replies(session, threads - {None})
+            threads = set()
+            if publisher is not None:
+                publisher.flush()
             session.commit()
             earliest, latest = None, None
             time_buffer = time.time()
 
+    loader.flush()
+    count_replies(session, threads - {None})
+    if publisher is not None:
+        publisher.flush()
     session.commit()
     return count
@@ -0,0 +1,228 @@
+"""Issue and pull request lifecycle metrics over github events.
+
+Lifecycles are reconstructed with vectorized numpy operations over the
+event columns, rather than per issue python loops or nested sql.
+"""
+import numpy as np
+import sqlalchemy as rdb
+
+from .github import GithubEvent
+
+
+Opened = ("opened",)
+Reopened = ("reopened",)
+Closed = ("closed",)
+
+ResponseEvents = (
+    "IssueCommentEvent",
+    "PullRequestReviewEvent",
+    "PullRequestReviewCommentEvent",
+)
+ReviewEvents = ("PullRequestReviewEvent", "PullRequestReviewCommentEvent")
+LifecycleEvents = ("IssuesEvent", "PullRequestEvent")
+
+Percentiles = (50, 75, 90, 99)
+Hour = np.timedelta64(3600, "s")
+# clickhouse datetimes aren't nullable, unset values come back as the epoch.
+Epoch = np.datetime64(0, "s")
+
+
+class Events:
+    """Columnar view of a project's lifecycle and response events."""
+
+    columns = (
+        "event_type",
+        "action",
+        "number",
+        "created_at",
+        "actor_login",
+        "merged_at",
+    )
+
+    def __init__(self, rows, open_before=0):
+        cols = list(zip(*rows)) or [()] * len(self.columns)
+        self._load(dict(zip(self.columns, cols)), open_before)
+
+    @classmethod
+    def from_columns(cls, data, open_before=0):
+        ev = cls.__new__(cls)
+        ev._load(data, open_before)
+        return ev
+
+    def _load(self, data, open_before):
+        # open issue count prior to the first event, when loaded with since
+        self.open_before = open_before
+        self.event_type = np.array(data["event_type"], dtype=object)
+        self.action = np.array(data["action"], dtype=object)
+        self.number = np.array(
+            [n or 0 for n in data["number"]], dtype=np.int64
+        )
+        self.created_at = np.array(data["created_at"], dtype="datetime64[s]")
+        self.merged_at = np.array(data["merged_at"], dtype="datetime64[s]")
+        self.merged_at[self.merged_at <= Epoch] = np.datetime64("NaT")
+        # factorize logins, so comparisons are on integers.
+        self.logins, self.actor = np.unique(
+            np.array([a or "" for a in data["actor_login"]], dtype=object),
+            return_inverse=True,
+        )
+
+        order = np.argsort(self.created_at, kind="stable")
+        for k in ("event_type", "action", "number", "created_at", "merged_at", "actor"):
+            setattr(self, k, getattr(self, k)[order])
+
+    @classmethod
+    def load(cls, session, project, since=None, archive=None):
+        event_types = LifecycleEvents + ResponseEvents
+        query = rdb.select(*[getattr(GithubEvent, c) for c in cls.columns]).where(
+            GithubEvent.repo_name == project,
+            GithubEvent.event_type.in_(event_types),
+        )
+        if since:
+            query = query.where(GithubEvent.created_at >= since)
+        rows = session.execute(query).all()
+        cols = list(zip(*rows)) or [()] * len(cls.columns)
+        data = {c: list(v) for c, v in zip(cls.columns, cols)}
+        if archive is not None:
+            archived = archive.archived_columns(
+                cls.columns, start=since, project=project, event_types=event_types
+            )
+            for c in cls.columns:
+                data[c].extend(archived[c])
+        open_before = since and open_issues(session, project, since, archive) or 0
+        return cls.from_columns(data, open_before)
+
+    def mask(self, event_types, actions=None):
+        m = np.isin(self.event_type, event_types)
+        if actions:
+            m &= np.isin(self.action, actions)
+        return m
+
+
+def open_issues(session, project, before, archive=None):
+    """Number of issues open at a point in time."""
+    delta = rdb.case((GithubEvent.action.in_(Closed), -1), else_=1)
+    count = session.execute(
+        rdb.select(rdb.func.coalesce(rdb.func.sum(delta), 0)).where(
+            GithubEvent.repo_name == project,
+            GithubEvent.event_type == "IssuesEvent",
+            GithubEvent.action.in_(Opened + Reopened + Closed),
+            GithubEvent.created_at < before,
+        )
+    ).scalar()
+    if archive is not None:
+        archived = archive.archived_columns(
+            ("action",), end=before, project=project, event_types=("IssuesEvent",)
+        )
+        for action in archived["action"]:
+            if action in Closed:
+                count -= 1
+            elif action in Opened + Reopened:
+                count += 1
+    return count
+
+
+def first_per_number(number, *arrays):
+    """Given arrays sorted by time, return the first entry for each number."""
+    numbers, idx = np.unique(number, return_index=True)
+    return (numbers,) + tuple(a[idx] for a in arrays)
+
+
+def distribution(hours):
+    hours = hours[~np.isnan(hours)]
+    if not len(hours):
+        return {"count": 0}
+    stats = {"count": int(len(hours)), "mean": round(float(hours.mean()), 2)}
+    for p, v in zip(Percentiles, np.percentile(hours, Percentiles)):
+        stats["p%d" % p] = round(float(v), 2)
+    return stats
+
+
+def time_to_first_response(ev: Events, event_type):
+    """Hours from an issue / pull request being opened to the first comment
+    or review by someone other than its author."""
+    m = ev.mask((event_type,), Opened)
+    numbers, opened, author = first_per_number(
+        ev.number[m], ev.created_at[m], ev.actor[m]
+    )
+
+    r = ev.mask(ResponseEvents)
+    rnumber, rtime, ractor = ev.number[r], ev.created_at[r], ev.actor[r]
+    # join responses to their opening event
+    pos = np.clip(np.searchsorted(numbers, rnumber), 0, max(len(numbers) - 1, 0))
+    matched = (
+        (numbers[pos] == rnumber) & (ractor != author[pos]) & (rtime >= opened[pos])
+        if len(numbers)
+        else np.zeros(len(rnumber), dtype=bool)
+    )
+    rnumbers, first = first_per_number(rnumber[matched], rtime[matched])
+
+    hours = np.full(len(numbers), np.nan)
+    answered = np.searchsorted(numbers, rnumbers)
+    hours[answered] = (first - opened[answered]) / Hour
+    stats = distribution(hours)
+    stats["unanswered"] = int(np.isnan(hours).sum())
+    return stats
+
+
+def time_to_merge(ev: Events):
+    """Hours from a pull request being opened to being merged."""
+    m = ev.mask(("PullRequestEvent",), Opened)
+    numbers, opened = first_per_number(ev.number[m], ev.created_at[m])
+
+    c = ev.mask(("PullRequestEvent",), Closed) & ~np.isnat(ev.merged_at)
+    mnumbers, merged = first_per_number(ev.number[c], ev.merged_at[c])
+
+    found = np.isin(mnumbers, numbers)
+    mnumbers, merged = mnumbers[found], merged[found]
+    opened = opened[np.searchsorted(numbers, mnumbers)]
+    return distribution((merged - opened) / Hour)
+
+
+def backlog(ev: Events):
+    """Open issue count at the end of each month."""
+    m = ev.mask(("IssuesEvent",), Opened + Reopened + Closed)
+    if not m.any():
+        return []
+    created = ev.created_at[m]
+    delta = np.where(np.isin(ev.action[m], Closed), -1, 1)
+    open_count = ev.open_before + np.cumsum(delta)
+
+    months = np.arange(
+        created[0].astype("datetime64[M]"),
+        created[-1].astype("datetime64[M]") + 2,
+        dtype="datetime64[M]",
+    )
+    # number of events before the start of the following month
+    idx = np.searchsorted(created, months[1:].astype("datetime64[s]")) - 1
+    counts = np.where(idx >= 0, open_count[np.maximum(idx, 0)], ev.open_before)
+    return [
+        {"month": str(month), "open": int(c)} for month, c in zip(months[:-1], counts)
+    ]
+
+
+def reviewer_load(ev: Events, top=10):
+    """Distinct pull requests reviewed per reviewer."""
+    m = ev.mask(ReviewEvents)
+    pairs = np.unique(np.stack([ev.actor[m], ev.number[m]], axis=1), axis=0)
+    reviewers, counts = np.unique(pairs[:, 0], return_counts=True)
+    stats = distribution(counts.astype(float))
+    ranked = np.argsort(-counts, kind="stable")[:top]
+    stats["top"] = [
+        {"login": ev.logins[reviewers[i]], "reviews": int(counts[i])} for i in ranked
+    ]
+    return stats
+
+
+def metrics(session, project, since=None, archive=None):
+    ev = Events.load(session, project, since, archive)
+    return {
+        "project": project,
+        "events": int(len(ev.number)),
+        "time_to_first_response": {
+            "issues": time_to_first_response(ev, "IssuesEvent"),
+            "pulls": time_to_first_response(ev, "PullRequestEvent"),
+        },
+        "time_to_merge": time_to_merge(ev),
+        "backlog": backlog(ev),
+        "reviewer_load": reviewer_load(ev),
+    }
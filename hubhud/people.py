@@ -0,0 +1,128 @@
+"""Identity table joining gitter authors and github actors.
+
+Gitter usernames come from github, so a person is keyed on their
+lowercased login, and the message and event tables reference them by an
+integer surrogate key.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import sqlalchemy as rdb
+
+from .schema import mapper_registry, F
+
+
+@mapper_registry.mapped
+@dataclass
+class Person:
+
+    __tablename__ = "people"
+    __sa_dataclass_metadata_key__ = "sa"
+
+    id: int = field(
+        init=False,
+        metadata={"sa": rdb.Column(rdb.Integer, primary_key=True)},
+    )
+    # Lowercased github / gitter login
+    login: str = F(rdb.Column(rdb.String(64), unique=True, nullable=False))
+    first_seen: datetime = F(rdb.DateTime, None)
+    last_seen: datetime = F(rdb.DateTime, None)
+    # Number of gitter messages authored
+    messages: int = F(rdb.Integer, 0)
+    # Number of github events acted
+    events: int = F(rdb.Integer, 0)
+
+
+def get_person(session, login: str) -> Person:
+    return session.execute(
+        rdb.select(Person).filter_by(login=login.lower())
+    ).scalar_one_or_none()
+
+
+class People:
+    """Resolve logins to person ids during a sync, keeping activity current.
+
+    Persons are cached for the lifetime of the sync, so each login costs at
+    most one indexed read.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._cache = {}
+
+    def get(self, login: str) -> Person:
+        key = login.lower()
+        p = self._cache.get(key)
+        if p is not None:
+            return p
+        p = get_person(self.session, key)
+        if p is None:
+            p = Person(login=key)
+            self.session.add(p)
+            # assign the surrogate key now so rows can reference it.
+            self.session.flush([p])
+        self._cache[key] = p
+        return p
+
+    def observe(self, login: str, when: datetime, messages=0, events=0):
+        if not login:
+            return None
+        p = self.get(login)
+        if when is not None:
+            if p.first_seen is None or when < p.first_seen:
+                p.first_seen = when
+            if p.last_seen is None or when > p.last_seen:
+                p.last_seen = when
+        if messages:
+            p.messages = (p.messages or 0) + messages
+        if events:
+            p.events = (p.events or 0) + events
+        return p.id
+
+    def resolve(self, login: str):
+        if not login:
+            return None
+        return self.get(login).id
+
+
+def backfill(session, login, pid, when=None, counter=None) -> int:
+    """Populate people and a person id column for rows stored before people
+    were tracked, from the row's login column.
+
+    Run as a one time migration by the sources, activity is aggregated per
+    login when a time and counter ("messages" or "events") are given.
+    """
+    unresolved = (login.isnot(None), login != "", pid.is_(None))
+    people = People(session)
+    if counter is None:
+        query = rdb.select(rdb.func.lower(login)).where(*unresolved).distinct()
+        for (key,) in session.execute(query).all():
+            people.get(key)
+    else:
+        query = (
+            rdb.select(
+                rdb.func.lower(login),
+                rdb.func.min(when),
+                rdb.func.max(when),
+                rdb.func.count(),
+            )
+            .where(*unresolved)
+            .group_by(rdb.func.lower(login))
+        )
+        for key, first, last, n in session.execute(query).all():
+            people.observe(key, first, **{counter: n})
+            people.observe(key, last)
+
+    result = session.execute(
+        rdb.update(login.class_.__table__)
+        .where(*unresolved)
+        .values(
+            {
+                pid.key: rdb.select(Person.id)
+                .where(Person.login == rdb.func.lower(login))
+                .scalar_subquery()
+            }
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
@@ -0,0 +1,84 @@
+"""Lazy command registry.
+
+Subcommands are named by "module:attribute" references that are only
+imported when the subcommand is invoked. Third party packages can add
+sources and commands by declaring entry points, ie. in pyproject.toml::
+
+  [tool.poetry.plugins."hubhud.sources"]
+  jira = "hubhud_jira.cli:sync"
+
+Entry points in the "hubhud.sources" group become `hubhud sync`
+subcommands, and those in "hubhud.commands" top level commands.
+"""
+from importlib import import_module
+
+import click
+
+
+SOURCES = "hubhud.sources"
+COMMANDS = "hubhud.commands"
+
+
+def resolve(ref: str):
+    module, _, attr = ref.partition(":")
+    obj = import_module(module)
+    for a in attr.split("."):
+        obj = getattr(obj, a)
+    return obj
+
+
+class LazyGroup(click.Group):
+    """Click group resolving registered subcommands on first use."""
+
+    def __init__(self, *args, lazy_commands=None, plugins=None, **kw):
+        super().__init__(*args, **kw)
+        self.lazy_commands = dict(lazy_commands or {})
+        self.plugins = plugins
+        self._plugins_loaded = False
+
+    def register(self, name: str, ref: str):
+        self.lazy_commands[name] = ref
+
+    def _load_plugins(self):
+        # only reads distribution metadata, plugin modules aren't imported.
+        if self._plugins_loaded or not self.plugins:
+            return
+        from importlib.metadata import entry_points
+
+        self._plugins_loaded = True
+        for ep in entry_points(group=self.plugins):
+            self.lazy_commands.setdefault(ep.name, ep.value)
+
+    def list_commands(self, ctx):
+        self._load_plugins()
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, name):
+        cmd = super().get_command(ctx, name)
+        if cmd is not None:
+            return cmd
+        self._load_plugins()
+        if name not in self.lazy_commands:
+            return None
+        cmd = resolve(self.lazy_commands[name])
+        self.add_command(cmd, name)
+        return cmd
+
+    def format_commands(self, ctx, formatter):
+        # list unresolved commands by name only, as fetching their short help
+        # would import every plugin just to render --help.
+        rows = []
+        for name in self.list_commands(ctx):
+            cmd = self.commands.get(name)
+            if cmd is None or not cmd.hidden:
+                rows.append((name, cmd))
+        if not rows:
+            return
+        limit = formatter.width - 6 - max(len(name) for name, _ in rows)
+        with formatter.section("Commands"):
+            formatter.write_dl(
+                [
+                    (name, cmd and cmd.get_short_help_str(limit) or "")
+                    for name, cmd in rows
+                ]
+            )
@@ -1,12 +1,25 @@
 from dataclasses import field
+from datetime import datetime
+import logging
 
 from dateutil.parser import parse as parse_date
 import sqlalchemy as rdb
-from sqlalchemy.orm import registry
+from sqlalchemy.orm import Session, registry
 
 
+log = logging.getLogger("hubhud.schema")
+
 mapper_registry = registry()
 
+# data migrations applied once per database, by name.
+applied_migrations = rdb.Table(
+    "schema_migrations",
+    mapper_registry.metadata,
+    rdb.Column("name", rdb.String, primary_key=True),
+    rdb.Column("applied_at", rdb.DateTime),
+)
+migrations = {}
+
 
 class SQLiteArray(rdb.types.TypeDecorator):
 
@@ -51,8 +64,66 @@ def F(ctype, default=()):
     return field(**params)
 
 
+def migration(name):
+    """Register a function(session) run once to migrate existing data."""
+
+    def register(func):
+        migrations[name] = func
+        return func
+
+    return register
+
+
+def upgrade(engine):
+    """Add columns and indexes missing from tables created by earlier versions.
+
+    create_all only creates missing tables, so columns added to a model
+    since are added here. New columns are nullable, data for them is
+    filled in by migrations.
+    """
+    inspector = rdb.inspect(engine)
+    with engine.begin() as conn:
+        for table in mapper_registry.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for c in table.columns:
+                if c.name in existing:
+                    continue
+                log.info("adding column %s.%s", table.name, c.name)
+                conn.execute(
+                    rdb.text(
+                        'ALTER TABLE "%s" ADD COLUMN %s'
+                        % (table.name, rdb.schema.CreateColumn(c).compile(dialect=conn.dialect))
+                    )
+                )
+            existing = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    log.info("creating index %s", index.name)
+                    index.create(conn)
+
+
+def migrate(engine):
+    with Session(engine) as s:
+        applied = set(s.execute(rdb.select(applied_migrations.c.name)).scalars())
+        for name, func in migrations.items():
+            if name in applied:
+                continue
+            log.info("applying migration %s", name)
+            func(s)
+            s.execute(
+                applied_migrations.insert().values(
+                    name=name, applied_at=datetime.utcnow()
+                )
+            )
+            s.commit()
+
+
 def get_db(db_uri):
     engine = rdb.create_engine(db_uri)
     mapper_registry.metadata.bind = engine
     mapper_registry.metadata.create_all(engine)
+    upgrade(engine)
+    migrate(engine)
     return engine
@@ -1,7 +1,18 @@
-import tantivy
-import sqlalchemy as rdb
+"""Full text search over gitter messages.
+
+Indexes are sharded by project, and optionally by year, with each shard
+in its own directory under the index path. Shards are rebuilt
+independently, and queries fan out across the selected shards in parallel
+with the top results merged by score.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import os
+from pathlib import Path
+import shutil
 
-from . import gitter
+import tantivy
 
 
 def get_schema():
@@ -10,41 +21,124 @@ def get_schema():
     schema_builder.add_text_field("author", stored=True)
     schema_builder.add_text_field("id", stored=True)
     schema_builder.add_text_field("body", stored=True)
+    schema_builder.add_text_field("project", stored=True)
     schema = schema_builder.build()
     return schema
 
 
-def search(path, query_phrase, max_results=10):
-    schema = get_schema()
-    index = tantivy.Index(schema, path, reuse=True)
+def shard_name(project, year=None):
+    name = project.replace("/", "__")
+    if year:
+        name += "@%d" % year
+    return name
 
+
+def get_shards(path, projects=None, years=None):
+    """Return the shard directories under path matching projects / years."""
+    root = Path(path)
+    if not root.exists():
+        return []
+    prefixes = projects and {shard_name(p) for p in projects}
+    shards = []
+    for d in sorted(root.iterdir()):
+        if not (d / "meta.json").exists():
+            continue
+        name, _, year = d.name.partition("@")
+        if prefixes and name not in prefixes:
+            continue
+        if years and (not year or int(year) not in years):
+            continue
+        shards.append(d)
+    return shards
+
+
+def search_shard(shard, query_phrase, max_results):
+    index = tantivy.Index(get_schema(), str(shard), reuse=True)
     searcher = index.searcher()
     query = index.parse_query(query_phrase, ["body", "author"])
+    return [
+        {"score": score, "shard": shard.name, "addr": addr, "doc": searcher.doc(addr)}
+        for (score, addr) in searcher.search(query, max_results).hits
+    ]
 
-    qresults = searcher.search(query, max_results).hits
-    results = []
 
-    for (score, addr) in qresults:
-        results.append({"score": score, "addr": addr, "doc": searcher.doc(addr)})
-    return results
+def search(path, query_phrase, max_results=10, projects=None, years=None):
+    # note scores are computed with per shard term statistics.
+    shards = get_shards(path, projects, years)
+    if not shards:
+        return []
+    workers = min(len(shards), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        shard_results = pool.map(
+            lambda s: search_shard(s, query_phrase, max_results), shards
+        )
+        return heapq.nlargest(
+            max_results,
+            itertools.chain.from_iterable(shard_results),
+            key=lambda r: r["score"],
+        )
 
 
-def index(session, path):
+def index(session, path, projects=None, years=None, by_year=False):
+    """Rebuild the shards for the given projects (default all).
 
-    schema = get_schema()
-    index = tantivy.Index(schema, path, reuse=True)
-    writer = index.writer()
+    Any other shards of a rebuilt project, from a previous layout or for
+    years without messages, are removed. With years only those year shards
+    are rebuilt, which requires the projects to already be sharded by year.
+    """
+    if years and not by_year:
+        raise ValueError("rebuilding by years requires year sharding")
+    if years:
+        # the other years of an unsharded project would be lost
+        unsharded = [d.name for d in get_shards(path, projects) if "@" not in d.name]
+        if unsharded:
+            raise ValueError(
+                "%s not sharded by year, rebuild all years to change layout"
+                % ", ".join(unsharded)
+            )
+    # only indexing reads the db, queries just need tantivy.
+    import sqlalchemy as rdb
+    from .gitter import Message
+
+    year = rdb.extract("year", Message.sent)
+    query = rdb.select(Message).order_by(Message.project, Message.sent)
+    if projects:
+        query = query.where(Message.project.in_(projects))
+    if years:
+        query = query.where(year.in_(years))
+
+    def shard_key(m):
+        return shard_name(m.project, by_year and m.sent.year or None)
 
+    schema = get_schema()
     count = 0
-    results = session.execute(
-        rdb.select(gitter.Message).order_by(rdb.desc(gitter.Message.sent))
-    )
-
-    for r in results.all():
-        m = r[0]
-        writer.add_document(
-            tantivy.Document(id=[m.id], sent=[m.sent], author=[m.author], body=[m.text])
-        )
-        count += 1
-    writer.commit()
+    built = set()
+    results = session.execute(query).scalars()
+    for name, messages in itertools.groupby(results, key=shard_key):
+        built.add(name)
+        shard = Path(path) / name
+        shard.mkdir(parents=True, exist_ok=True)
+        writer = tantivy.Index(schema, str(shard), reuse=True).writer()
+        writer.delete_all_documents()
+        for m in messages:
+            writer.add_document(
+                tantivy.Document(
+                    id=[m.id],
+                    sent=[m.sent],
+                    author=[m.author],
+                    body=[m.text],
+                    project=[m.project],
+                )
+            )
+            count += 1
+        writer.commit()
+        writer.wait_merging_threads()
+
+    for shard in get_shards(path, projects):
+        if shard.name in built:
+            continue
+        _, _, year = shard.name.partition("@")
+        if years and (not year or int(year) not in years):
+            continue
+        shutil.rmtree(shard)
     return count
@@ -0,0 +1,223 @@
+"""Near duplicate detection over gitter messages.
+
+Top level messages are summarized by a MinHash signature over their word
+shingles, and banded into locality sensitive hash buckets. Candidate
+duplicates are found with indexed lookups on the (band, bucket) pairs of
+a message, so a query doesn't compare against the whole corpus.
+"""
+from dataclasses import dataclass
+import itertools
+import re
+import zlib
+
+import numpy as np
+import sqlalchemy as rdb
+
+from .schema import mapper_registry, F
+
+
+NumPerm = 128
+Bands = 32
+Rows = NumPerm // Bands
+# messages with fewer words are too short to meaningfully compare
+MinTokens = 4
+Threshold = 0.5
+
+# permutations are (a * x + b) mod prime, seeded so signatures are stable
+# across runs.
+Prime = (1 << 31) - 1
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, Prime, NumPerm).astype(np.uint64)
+_B = _rng.randint(0, Prime, NumPerm).astype(np.uint64)
+
+_token_re = re.compile(r"\w+")
+
+
+@mapper_registry.mapped
+@dataclass
+class MessageSignature:
+
+    __tablename__ = "gitter_minhash"
+    __sa_dataclass_metadata_key__ = "sa"
+
+    # ID of the message.
+    id: str = F(rdb.Column(rdb.String, primary_key=True))
+    # Track which github project we're referencing
+    project: str = F(rdb.String)
+    # MinHash signature, NumPerm uint32 values
+    signature: bytes = F(rdb.LargeBinary)
+
+
+@mapper_registry.mapped
+@dataclass
+class Bucket:
+
+    __tablename__ = "gitter_lsh"
+    __sa_dataclass_metadata_key__ = "sa"
+
+    band: int = F(rdb.Column(rdb.SmallInteger, primary_key=True))
+    bucket: int = F(rdb.Column(rdb.BigInteger, primary_key=True))
+    message_id: str = F(rdb.Column(rdb.String, primary_key=True))
+
+
+def shingles(text):
+    tokens = _token_re.findall((text or "").lower())
+    if len(tokens) < MinTokens:
+        return None
+    grams = {" ".join(pair) for pair in zip(tokens, tokens[1:])}
+    return np.array(
+        [zlib.crc32(g.encode("utf8")) for g in grams], dtype=np.uint64
+    ) % np.uint64(Prime)
+
+
+def minhash(text):
+    """Return the MinHash signature of a text, or None if it is too short."""
+    x = shingles(text)
+    if x is None:
+        return None
+    return ((_A[:, None] * x[None, :] + _B[:, None]) % Prime).min(axis=1).astype(
+        np.uint32
+    )
+
+
+def bands(signature):
+    rows = signature.reshape(Bands, Rows)
+    return [(band, zlib.crc32(rows[band].tobytes())) for band in range(Bands)]
+
+
+def similarity(a, b):
+    """Estimated jaccard similarity of two signatures."""
+    return float(np.mean(a == b))
+
+
+def to_signature(data: bytes):
+    return np.frombuffer(data, dtype=np.uint32)
+
+
+class SimilarityIndex:
+    """Maintain signatures and lsh buckets for messages as they're synced."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def add(self, m):
+        # only index the start of conversations, replies come with the thread.
+        if m.parent:
+            return
+        sig = minhash(m.text)
+        existing = self.session.get(MessageSignature, m.id)
+        if existing is not None:
+            if sig is not None and existing.signature == sig.tobytes():
+                return
+            self.remove(existing)
+        if sig is None:
+            return
+        self.session.add(
+            MessageSignature(id=m.id, project=m.project, signature=sig.tobytes())
+        )
+        self.session.add_all(
+            [Bucket(band=b, bucket=h, message_id=m.id) for b, h in bands(sig)]
+        )
+
+    def remove(self, found: MessageSignature):
+        self.session.execute(rdb.delete(Bucket).where(Bucket.message_id == found.id))
+        self.session.delete(found)
+        self.session.flush()
+
+    def flush(self):
+        self.session.flush()
+
+    def candidates(self, signature, project=None, exclude=None):
+        query = rdb.select(Bucket.message_id).where(
+            rdb.tuple_(Bucket.band, Bucket.bucket).in_(bands(signature))
+        )
+        if exclude:
+            query = query.where(Bucket.message_id != exclude)
+        query = rdb.select(MessageSignature).where(
+            MessageSignature.id.in_(query.distinct())
+        )
+        if project:
+            query = query.where(MessageSignature.project == project)
+        return self.session.execute(query).scalars()
+
+    def similar(self, message_id, threshold=Threshold, limit=10):
+        """Return [(message_id, similarity)] for near duplicates of a message."""
+        found = self.session.get(MessageSignature, message_id)
+        if found is None:
+            return []
+        sig = to_signature(found.signature)
+        results = [
+            (c.id, similarity(sig, to_signature(c.signature)))
+            for c in self.candidates(sig, exclude=message_id)
+        ]
+        results = [r for r in results if r[1] >= threshold]
+        results.sort(key=lambda r: r[1], reverse=True)
+        return results[:limit]
+
+    def rebuild(self, messages):
+        count = 0
+        for m in messages:
+            self.add(m)
+            count += 1
+            if count % 1000 == 0:
+                self.flush()
+        self.flush()
+        return count
+
+    def cluster(self, project=None, threshold=Threshold):
+        """Group all indexed messages into clusters of near duplicates.
+
+        Messages with identical signatures are grouped up front. Then within
+        each bucket, a message is unioned with the bucket's cluster
+        representatives that meet the similarity threshold, or else becomes a
+        representative, so large buckets of boilerplate aren't compared
+        pairwise.
+        """
+        query = rdb.select(MessageSignature.id, MessageSignature.signature)
+        if project:
+            query = query.where(MessageSignature.project == project)
+
+        parent, sigs, exact = {}, {}, {}
+        for mid, s in self.session.execute(query):
+            head = exact.setdefault(s, mid)
+            parent[mid] = head
+            if head == mid:
+                sigs[mid] = to_signature(s)
+
+        def find(x):
+            while parent[x] != x:
+                x = parent[x]
+            return x
+
+        query = (
+            rdb.select(Bucket.band, Bucket.bucket, Bucket.message_id)
+            .where(
+                rdb.tuple_(Bucket.band, Bucket.bucket).in_(
+                    rdb.select(Bucket.band, Bucket.bucket)
+                    .group_by(Bucket.band, Bucket.bucket)
+                    .having(rdb.func.count() > 1)
+                )
+            )
+            .order_by(Bucket.band, Bucket.bucket)
+        )
+        rows = self.session.execute(query)
+        for _, members in itertools.groupby(rows, key=lambda r: (r[0], r[1])):
+            reps = []
+            for mid in sorted({parent[r[2]] for r in members if r[2] in parent}):
+                matched = False
+                for rep in reps:
+                    if similarity(sigs[mid], sigs[rep]) >= threshold:
+                        a, b = find(rep), find(mid)
+                        if a != b:
+                            parent[b] = a
+                        matched = True
+                if not matched:
+                    reps.append(mid)
+
+        clusters = {}
+        for mid in parent:
+            clusters.setdefault(find(mid), set()).add(mid)
+        return sorted(
+            (sorted(c) for c in clusters.values() if len(c) > 1),
+            key=lambda c: (-len(c), c),
+        )
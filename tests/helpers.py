@@ -0,0 +1,38 @@
+"""Shared builders for test messages and events."""
+from dataclasses import fields
+
+from hubhud.github import GithubEvent
+from hubhud.gitter import Message
+
+
+PROJECT = 'cloud-custodian/cloud-custodian'
+
+
+def message_data(mid, text='hello', sent='2021-12-01T10:00:00.000Z', **kw):
+    """A message as returned by the gitter api."""
+    m = {
+        'id': mid, 'text': text, 'html': text, 'sent': sent,
+        'fromUser': {'username': 'kapilt'}, 'unread': False, 'readBy': 0,
+        'urls': [], 'mentions': [], 'issues': [], 'meta': {}, 'v': 1}
+    m.update(kw)
+    return m
+
+
+def make_message(mid, text='hello', sent='2021-12-01T10:00:00.000Z', project=PROJECT, **kw):
+    return Message.new(message_data(mid, text, sent, project=project, **kw))
+
+
+def make_event(actor, created_at, **kw):
+    data = {
+        f.name: None for f in fields(GithubEvent) if f.name not in GithubEvent.__local_fields__
+    }
+    data.update(
+        event_type='IssuesEvent',
+        actor_login=actor,
+        repo_name=PROJECT,
+        created_at=created_at,
+        labels=[],
+        assignees=[],
+    )
+    data.update(kw)
+    return GithubEvent(**data)
@@ -0,0 +1,127 @@
+from datetime import datetime
+import os
+import stat
+
+import sqlalchemy as rdb
+from sqlalchemy.orm import Session
+
+from hubhud import github
+from hubhud.archive import Archive
+from hubhud.bulk import BulkLoader
+from hubhud.github import GithubEvent
+from hubhud.metrics import metrics
+from hubhud.schema import get_db
+
+from helpers import make_event
+
+
+NOW = datetime(2021, 12, 15)
+
+
+def load(s, events):
+    loader = BulkLoader(s, GithubEvent)
+    for e in events:
+        loader.add(e)
+    loader.flush()
+    s.commit()
+
+
+def test_archive_months(tmp_path):
+    archive = Archive(tmp_path)
+    with Session(get_db('sqlite://')) as s:
+        load(s, [
+            make_event('kapilt', datetime(2021, 6, 3), event_type='IssuesEvent',
+                       action='opened', number=1, labels=['bug']),
+            make_event('ajkerrigan', datetime(2021, 6, 20), event_type='IssueCommentEvent',
+                       action='created', number=1),
+            make_event('kapilt', datetime(2021, 8, 1), event_type='IssuesEvent',
+                       action='closed', number=1),
+            make_event('kapilt', datetime(2021, 11, 1), event_type='PushEvent'),
+        ])
+        assert archive.archive(s, keep_days=90, now=NOW) == 3
+        assert [m.month for m in archive.months()] == [6, 8]
+        assert not os.stat(archive.month_path(datetime(2021, 6, 1))).st_mode & stat.S_IWUSR
+        assert s.execute(rdb.select(rdb.func.count(GithubEvent.id))).scalar() == 1
+        assert archive.last_created_at() == datetime(2021, 8, 1)
+
+        # nothing left to move, rerunning is a noop
+        assert archive.archive(s, keep_days=90, now=NOW) == 0
+
+        events = list(archive.events(s))
+        assert [e.created_at.month for e in events] == [6, 6, 8, 11]
+        assert events[0].labels == ['bug']
+        assert [e.id for e in events] == [1, 2, 3, 4]
+
+        june = list(archive.events(s, start=datetime(2021, 6, 10), end=datetime(2021, 9, 1)))
+        assert [e.actor_login for e in june] == ['ajkerrigan', 'kapilt']
+
+        results = metrics(s, 'cloud-custodian/cloud-custodian', archive=archive)
+        assert results['time_to_first_response']['issues']['count'] == 1
+
+
+def test_archived_columns(tmp_path):
+    archive = Archive(tmp_path)
+    with Session(get_db('sqlite://')) as s:
+        load(s, [
+            make_event('kapilt', datetime(2021, 6, 3), action='opened', number=1),
+            make_event('kapilt', datetime(2021, 6, 4), repo_name='kapilt/gittersearch'),
+            make_event('ajkerrigan', datetime(2021, 6, 20), event_type='PushEvent'),
+            make_event('ajkerrigan', datetime(2021, 7, 2), action='closed', number=1),
+            make_event('kapilt', datetime(2021, 8, 1), action='reopened', number=1,
+                       merged_at=datetime(2021, 8, 1)),
+        ])
+        archive.archive(s, keep_days=90, now=NOW)
+        # backlog seeded from archived issue events before since
+        results = metrics(s, 'cloud-custodian/cloud-custodian', since=datetime(2021, 6, 10),
+                          archive=archive)
+        assert results['backlog'] == [{'month': '2021-07', 'open': 0},
+                                      {'month': '2021-08', 'open': 1}]
+
+    columns = archive.archived_columns(
+        ('action', 'created_at', 'merged_at'), project='cloud-custodian/cloud-custodian',
+        event_types=('IssuesEvent',))
+    assert columns['action'] == ['opened', 'closed', 'reopened']
+    assert columns['merged_at'] == [None, None, datetime(2021, 8, 1)]
+
+    columns = archive.archived_columns(
+        ('actor_login',), start=datetime(2021, 6, 4), end=datetime(2021, 8, 1))
+    assert columns == {'actor_login': ['kapilt', 'ajkerrigan', 'ajkerrigan']}
+
+    # none of july's events are before end
+    assert archive.archived_columns(('id',), end=datetime(2021, 7, 1, 12)) == {
+        'id': [1, 2, 3]}
+
+
+def test_archive_ids_reused(tmp_path):
+    archive = Archive(tmp_path)
+    with Session(get_db('sqlite://')) as s:
+        load(s, [make_event('kapilt', datetime(2021, 6, 3), labels=[])])
+        archive.archive(s, keep_days=90, now=NOW)
+        # a late event for an archived month
+        load(s, [make_event('ajkerrigan', datetime(2021, 6, 4), labels=[])])
+        archive.archive(s, keep_days=90, now=NOW)
+        assert [e.actor_login for e in archive.events(s)] == ['kapilt', 'ajkerrigan']
+
+    # rows with reused ids are kept, rewriting the same event isn't duplicated
+    rows = archive.read_month(datetime(2021, 6, 1))
+    archive.write_month(datetime(2021, 6, 1), [
+        dict(rows[0], id=rows[1]['id']), dict(rows[1], id=1, actor_login='jtroberts')])
+    assert [r['actor_login'] for r in archive.read_month(datetime(2021, 6, 1))] == [
+        'kapilt', 'ajkerrigan', 'jtroberts']
+
+
+def test_sync_watermark_from_archive(tmp_path, monkeypatch):
+    archive = Archive(tmp_path)
+    with Session(get_db('sqlite://')) as s:
+        load(s, [make_event('kapilt', datetime(2021, 6, 3))])
+        archive.archive(s, keep_days=90, now=NOW)
+
+        seen = {}
+
+        def get_events(project, **kw):
+            seen.update(kw)
+            return iter(())
+
+        monkeypatch.setattr(github, 'get_events', get_events)
+        github.sync(s, 'cloud-custodian/cloud-custodian', None, archive=archive)
+        assert seen['start'] == datetime(2021, 6, 3)
@@ -0,0 +1,107 @@
+from datetime import datetime
+import os
+
+import pytest
+
+import sqlalchemy as rdb
+from sqlalchemy.orm import Session
+
+from hubhud.bulk import BulkLoader, csv_line
+from hubhud.github import GithubEvent
+from hubhud.gitter import Message
+from hubhud.schema import get_db, mapper_registry
+
+from helpers import make_event, make_message
+
+
+def test_sqlite_upsert():
+    with Session(get_db('sqlite://')) as s:
+        loader = BulkLoader(s, Message, batch_size=3)
+        loader.add(make_message('a', 'one'))
+        loader.add(make_message('b', 'two'))
+        loader.add(make_message('a', 'three'))
+        assert loader.flush() == 2
+        loader.add(make_message('b', 'four'))
+        loader.add(make_message('c', 'five'))
+        loader.flush()
+        s.commit()
+        rows = s.execute(rdb.select(Message.id, Message.text).order_by(Message.id)).all()
+        assert [tuple(r) for r in rows] == [('a', 'three'), ('b', 'four'), ('c', 'five')]
+        assert loader.loaded == 4
+
+
+def test_sqlite_append_identity():
+    with Session(get_db('sqlite://')) as s:
+        loader = BulkLoader(s, GithubEvent, batch_size=2)
+        for i in range(5):
+            loader.add(make_event('kapilt', datetime(2021, 1, i + 1), labels=['bug']))
+        loader.flush()
+        s.commit()
+        events = s.execute(rdb.select(GithubEvent).order_by(GithubEvent.id)).scalars().all()
+        assert [e.id for e in events] == [1, 2, 3, 4, 5]
+        assert events[0].labels == ['bug']
+
+
+def test_copy_csv_format():
+    m = make_message('a', 'say "hi"')
+    m.meta = {'k': 1}
+    columns = [Message.__table__.c[n] for n in ('id', 'text', 'sent', 'unread', 'meta', 'gv')]
+    assert csv_line({c.name: getattr(m, c.name) for c in columns}, columns) == (
+        '"a","say ""hi""","2021-12-01T10:00:00","f","{""k"": 1}",\n')
+
+    columns = [GithubEvent.__table__.c.labels]
+    assert csv_line({'labels': ['a', 'b "c"']}, columns) == '"{""a"",""b \\""c\\""""}"\n'
+
+
+@pytest.fixture
+def pg_session():
+    engine = get_db(os.environ['TEST_PG_URL'])
+    try:
+        with Session(engine) as s:
+            yield s
+    finally:
+        mapper_registry.metadata.drop_all(engine)
+        engine.dispose()
+
+
+@pytest.mark.skipif(not os.environ.get('TEST_PG_URL'), reason='postgres db required')
+def test_postgres_copy_upsert(pg_session):
+    s = pg_session
+    loader = BulkLoader(s, Message, batch_size=3)
+    loader.add(make_message('a', 'one'))
+    loader.add(make_message('b', 'say "two"'))
+    loader.add(make_message('a', 'three'))
+    m = make_message('c', 'back\\slash, comma')
+    m.meta = {'k': [1, None]}
+    loader.add(m)
+    loader.flush()
+    s.commit()
+    # conflicts with committed rows update them
+    loader.add(make_message('b', 'four'))
+    loader.flush()
+    s.commit()
+
+    rows = s.execute(rdb.select(Message.id, Message.text).order_by(Message.id)).all()
+    assert [tuple(r) for r in rows] == [
+        ('a', 'three'), ('b', 'four'), ('c', 'back\\slash, comma')]
+    c = s.get(Message, 'c')
+    assert c.meta == {'k': [1, None]}
+    assert c.sent == datetime(2021, 12, 1, 10)
+    assert (c.unread, c.gv) == (False, None)
+    assert loader.loaded == 4
+
+
+@pytest.mark.skipif(not os.environ.get('TEST_PG_URL'), reason='postgres db required')
+def test_postgres_copy_append_identity(pg_session):
+    s = pg_session
+    loader = BulkLoader(s, GithubEvent, batch_size=2)
+    for i in range(3):
+        loader.add(make_event(
+            'kapilt', datetime(2021, 1, i + 1), labels=['bug', 'say "hi"'], number=i))
+    loader.flush()
+    s.commit()
+    events = s.execute(rdb.select(GithubEvent).order_by(GithubEvent.id)).scalars().all()
+    assert [e.number for e in events] == [0, 1, 2]
+    assert len({e.id for e in events}) == 3
+    assert events[0].labels == ['bug', 'say "hi"']
+    assert events[0].assignees == []
@@ -0,0 +1,77 @@
+import os
+from datetime import datetime
+
+from hubhud import github
+from hubhud.cache import BlockCache
+
+
+SCHEMA = [('created_at', 'DateTime'), ('actor_login', 'LowCardinality(String)'),
+          ('labels', 'Array(LowCardinality(String))')]
+
+
+def test_block_roundtrip(tmp_path):
+    cache = BlockCache(tmp_path)
+    rows = [(datetime(2021, 1, 1, 10), 'kapilt', ['bug']),
+            (datetime(2021, 1, 2, 11), 'ajkerrigan', [])]
+    assert cache.get('cloud-custodian/cloud-custodian', '202101', 'abc') is None
+    cache.put('cloud-custodian/cloud-custodian', '202101', 'abc', SCHEMA, rows)
+    schema, cached = cache.get('cloud-custodian/cloud-custodian', '202101', 'abc')
+    assert schema == SCHEMA
+    assert [list(r) for r in cached] == [list(r) for r in rows]
+    assert cache.get('cloud-custodian/cloud-custodian', '202101', 'def') is None
+
+
+def test_block_eviction(tmp_path):
+    cache = BlockCache(tmp_path)
+    rows = [(datetime(2021, 1, 1, 10), str(i) * 200, []) for i in range(100)]
+    cache.put('p', '202101', 'abc', SCHEMA, rows)
+    cache.max_bytes = cache.size() * 2.5
+    cache.put('p', '202102', 'abc', SCHEMA, rows)
+    # give the blocks distinct access times, then read the oldest.
+    os.utime(cache.key_path('p', '202101', 'abc'), (1, 1))
+    os.utime(cache.key_path('p', '202102', 'abc'), (2, 2))
+    cache.get('p', '202101', 'abc')
+    cache.put('p', '202103', 'abc', SCHEMA, rows)
+    assert cache.size() <= cache.max_bytes
+    assert cache.get('p', '202102', 'abc') is None
+    assert cache.get('p', '202101', 'abc') is not None
+
+
+def test_cached_events_windows(tmp_path, monkeypatch):
+    queries = []
+
+    def query_events(project, start=None, end=None, limit=0, direction='',
+                     start_inclusive=False):
+        queries.append((start, end))
+        rows = [(datetime(2021, m, 15), 'kapilt', []) for m in range(1, 13)]
+        rows = [r for r in rows if (not start or r[0] >= start) and (not end or r[0] < end)]
+        return SCHEMA, iter(rows)
+
+    monkeypatch.setattr(github, 'query_events', query_events)
+    cache = BlockCache(tmp_path)
+    start, end = datetime(2021, 2, 20), datetime(2021, 5, 1)
+
+    def fetch():
+        return [r for _, rows in github.cached_events(cache, 'p', start, end) for r in rows]
+
+    rows = fetch()
+    assert [r[0].month for r in rows] == [3, 4]
+    assert len(queries) == 3
+    assert fetch() == rows
+    assert len(queries) == 3
+
+
+def test_first_event_not_cached_before_events(tmp_path, monkeypatch):
+    cache = BlockCache(tmp_path)
+    results = [[(datetime(1970, 1, 1),)], [(datetime(2021, 3, 1),)]]
+
+    class Client:
+        def execute(self, query, params):
+            return results.pop(0)
+
+    monkeypatch.setattr(github, 'get_client', Client)
+    assert github.first_event(cache, 'p', 'abc') is None
+    assert github.first_event(cache, 'p', 'abc') == datetime(2021, 3, 1)
+    # found once there are events, then served from the cache
+    assert github.first_event(cache, 'p', 'abc') == datetime(2021, 3, 1)
+    assert results == []
@@ -0,0 +1,111 @@
+import json
+import os
+import subprocess
+import sys
+
+import click
+from click.testing import CliRunner
+import pytest
+
+from hubhud.registry import LazyGroup
+
+
+HEAVY = {'sqlalchemy', 'clickhouse_driver', 'tantivy', 'numpy', 'boto3', 'requests',
+         'dateutil'}
+DB = {'sqlalchemy', 'dateutil'}
+
+# we're called thousands of times a day from bots and hooks, so each command
+# should only load the heavy dependencies its backend needs, within an import
+# time budget. commands run for real against an empty db, failing fast where
+# they'd need the network.
+STARTUP = '''
+import json, sys
+args = sys.argv[1:]
+if args[:2] == ["sync", "github"]:
+    import hubhud.github
+
+    def offline():
+        raise ConnectionError("offline")
+
+    hubhud.github.get_client = offline
+from hubhud.cli import cli
+try:
+    cli(args, standalone_mode=False)
+except Exception as e:
+    print("exited %r" % e)
+print(json.dumps(sorted({m.split(".")[0] for m in sys.modules})))
+'''
+
+# cumulative module import time budget in milliseconds, generous as it's
+# only meant to catch a command pulling in a heavy dependency.
+HELP, LIGHT, HEAVIER = 300, 500, 2000
+
+
+def run_command(args):
+    """Return (heavy modules, import time in ms) for a cli invocation."""
+    env = dict(os.environ, AWS_DEFAULT_REGION='us-east-1')
+    env.pop('GITTER_TOKEN', None)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP] + args,
+        capture_output=True, text=True, env=env, check=True)
+    modules = set(json.loads(result.stdout.strip().splitlines()[-1]))
+    # import time: self [us] | cumulative | imported package
+    elapsed = sum(
+        int(line.split(':', 1)[1].split('|')[0])
+        for line in result.stderr.splitlines()
+        if line.startswith('import time:') and 'self [us]' not in line)
+    return HEAVY.intersection(modules), elapsed / 1000.0
+
+
+@pytest.mark.parametrize('command,allowed,budget', [
+    ('--help', set(), HELP),
+    ('search --help', set(), HELP),
+    ('sync --help', set(), HELP),
+    ('search query -i {index} -q ec2', {'tantivy'}, LIGHT),
+    ('search index -f {db} -i {index}', DB | {'tantivy', 'requests'}, HEAVIER),
+    ('search similar -f {db} --id a', DB | {'numpy', 'requests'}, HEAVIER),
+    ('search cluster -f {db}', DB | {'numpy', 'requests'}, HEAVIER),
+    ('metrics -f {db} -p a/b', DB | {'numpy'}, HEAVIER),
+    ('sync github -f {db} -p a/b', DB, HEAVIER),
+    ('sync gitter -f {db} -p a/b', DB | {'numpy', 'requests'}, HEAVIER),
+    ('sync gitter -f {db} -p a/b --no-similar', DB | {'requests'}, HEAVIER),
+    ('sync gitter -f {db} -p a/b --no-similar --stream s', DB | {'requests', 'boto3'},
+     HEAVIER),
+    ('sync firehose -f {db} -p a/b', DB | {'requests', 'boto3'}, HEAVIER)])
+def test_command_startup(tmp_path, command, allowed, budget):
+    args = command.format(
+        db='sqlite:///%s' % (tmp_path / 'hud.db'), index=tmp_path / 'index').split()
+    # best of a few runs, to be robust to a busy machine.
+    results = [run_command(args) for _ in range(3)]
+    assert results[0][0] <= allowed
+    assert min(r[1] for r in results) < budget
+
+
+def test_lazy_group_registry():
+    @click.group(cls=LazyGroup)
+    def group():
+        pass
+
+    group.register('stats', 'hubhud.cli:metrics')
+    ctx = click.Context(group)
+    assert 'stats' in group.list_commands(ctx)
+    assert 'stats' not in group.commands
+    assert group.get_command(ctx, 'stats').name == 'metrics'
+    assert group.get_command(ctx, 'missing') is None
+
+
+def test_lazy_group_help_doesnt_resolve():
+    @click.group(cls=LazyGroup)
+    def group():
+        pass
+
+    @group.command()
+    def local():
+        """A local command"""
+
+    group.register('plugin', 'hubhud_missing_plugin:command')
+    result = CliRunner().invoke(group, ['--help'])
+    assert result.exit_code == 0
+    assert 'plugin' in result.output
+    assert 'A local command' in result.output
+    assert 'plugin' not in group.commands
@@ -0,0 +1,136 @@
+import base64
+import dataclasses
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+
+import boto3
+import pytest
+from sqlalchemy.orm import Session
+
+from hubhud.firehose import FirehoseCheckpoint, FirehosePublisher, publish, serialize
+from hubhud.schema import get_db
+
+from helpers import make_message
+
+
+class FirehoseStub(BaseHTTPRequestHandler):
+
+    # per server list of batches received and records to reject.
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        records = [base64.b64decode(r["Data"]) for r in body["Records"]]
+        self.server.batches.append(records)
+        responses = []
+        for r in records:
+            if self.server.reject and r in self.server.reject:
+                self.server.reject.remove(r)
+                responses.append(
+                    {"ErrorCode": "ServiceUnavailableException", "ErrorMessage": "slow"}
+                )
+            else:
+                responses.append({"RecordId": "x"})
+        failed = len([r for r in responses if "ErrorCode" in r])
+        data = json.dumps({"FailedPutCount": failed, "RequestResponses": responses})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.1")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data.encode("utf8"))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = HTTPServer(("127.0.0.1", 0), FirehoseStub)
+    server.batches = []
+    server.reject = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = boto3.client(
+        "firehose",
+        endpoint_url="http://127.0.0.1:%d" % server.server_port,
+        region_name="us-east-1",
+        aws_access_key_id="stub",
+        aws_secret_access_key="stub",
+    )
+    yield server, client
+    server.shutdown()
+
+
+def message(i, **kw):
+    return make_message("m%d" % i, sent="2021-12-01T10:00:%02d.000Z" % (i % 60), **kw)
+
+
+def test_publisher_batches_by_count(stub):
+    server, client = stub
+    with Session(get_db("sqlite://")) as s:
+        p = FirehosePublisher(s, "cloud-custodian/cloud-custodian", client=client)
+        for i in range(1200):
+            p.add(message(i))
+        assert p.flush() == 1200
+        assert [len(b) for b in server.batches] == [500, 500, 200]
+        assert p.checkpoint.published == 1200
+        assert p.checkpoint.last_id == "m959"
+
+
+def test_publisher_batches_by_size(stub):
+    server, client = stub
+    with Session(get_db("sqlite://")) as s:
+        p = FirehosePublisher(s, "cloud-custodian/cloud-custodian", client=client)
+        for i in range(12):
+            p.add(message(i, text="x" * 400 * 1024))
+        assert p.flush() == 12
+        assert [len(b) for b in server.batches] == [5, 5, 2]
+
+
+def test_publisher_retries_failed_records(stub):
+    server, client = stub
+    with Session(get_db("sqlite://")) as s:
+        p = FirehosePublisher(s, "cloud-custodian/cloud-custodian", client=client)
+        p.retry_interval = 0
+        messages = [message(i) for i in range(10)]
+        for m in messages:
+            p.add(m)
+        server.reject.extend([serialize(m) for m in messages[3:5]])
+        p.flush()
+        assert [len(b) for b in server.batches] == [10, 2]
+
+
+def test_publish_from_checkpoint(stub):
+    server, client = stub
+    with Session(get_db("sqlite://")) as s:
+        for i in range(5):
+            s.add(message(i))
+        s.commit()
+        assert publish(s, "cloud-custodian/cloud-custodian", client=client) == 5
+        assert publish(s, "cloud-custodian/cloud-custodian", client=client) == 0
+
+        s.add(message(7))
+        s.commit()
+        assert publish(s, "cloud-custodian/cloud-custodian", client=client) == 1
+        cp = s.get(
+            FirehoseCheckpoint, ("gitter-s3-archive", "cloud-custodian/cloud-custodian")
+        )
+        assert cp.published == 6
+        assert cp.last_id == "m7"
+
+
+def test_publish_checkpoint_same_timestamp(stub):
+    server, client = stub
+    sent = datetime(2021, 12, 1, 10)
+    with Session(get_db("sqlite://")) as s:
+        for i in range(5):
+            s.add(dataclasses.replace(message(i), sent=sent))
+        s.commit()
+        assert publish(s, "cloud-custodian/cloud-custodian", client=client) == 5
+
+        # later messages sharing the checkpoint timestamp aren't skipped
+        for i in range(5, 7):
+            s.add(dataclasses.replace(message(i), sent=sent))
+        s.commit()
+        assert publish(s, "cloud-custodian/cloud-custodian", client=client) == 2
+        assert publish(s, "cloud-custodian/cloud-custodian", client=client) == 0
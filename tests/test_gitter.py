@@ -4,6 +4,8 @@ import pytest
 from dateutil.parser import parse
 from hubhud.gitter import GitterClient, Room, MessageIterator, Message
 
+from helpers import make_message, message_data
+
 
 
 @pytest.mark.skipif(not os.environ.get('GITTER_TOKEN'), reason='api token required')
@@ -42,3 +44,84 @@ def test_message_iterator():
 
 
     
+class FakeClient:
+
+    def __init__(self, messages, threads):
+        self._messages = messages
+        self._threads = threads
+        self.thread_requests = []
+
+    def messages(self, roomId, afterId=None, beforeId=None, limit=100):
+        if afterId or beforeId:
+            return []
+        return self._messages
+
+    def message_thread(self, roomId, parentId, beforeId=None, limit=None):
+        self.thread_requests.append((parentId, beforeId))
+        thread = self._threads[parentId]
+        if beforeId:
+            thread = thread[:[t['id'] for t in thread].index(beforeId)]
+        return thread[-limit:]
+
+
+def make_thread(parent, count):
+    return [
+        message_data('%s-%03d' % (parent, i),
+                     sent='2021-12-01T11:%02d:%02d.000Z' % (i // 60, i % 60),
+                     parentId=parent)
+        for i in range(count)]
+
+
+def test_thread_delta_and_pagination():
+    room = Room(id='r1', uri='cloud-custodian/cloud-custodian', **{
+        f: None for f in Room.__mapper__.column_attrs.keys() if f not in ('id', 'uri')})
+    threads = {'a': make_thread('a', 3), 'b': make_thread('b', 120)}
+    client = FakeClient([
+        message_data('a', sent='2021-12-01T10:00:00.000Z', threadMessageCount=3),
+        message_data('b', sent='2021-12-01T10:01:00.000Z', threadMessageCount=120),
+        message_data('c', sent='2021-12-01T10:02:00.000Z')], threads)
+
+    messages = list(MessageIterator(client, room, thread_counts={'a': 3}.get))
+    assert [p for p, _ in client.thread_requests] == ['b', 'b', 'b']
+    replies = [m.id for m in messages if m.parent == 'b']
+    assert replies == [t['id'] for t in threads['b']]
+    assert not [m for m in messages if m.parent == 'a']
+
+
+def test_get_thread():
+    from sqlalchemy.orm import Session
+    from hubhud.gitter import Thread, count_replies, get_thread, update_thread
+    from hubhud.schema import get_db
+
+    with Session(get_db('sqlite://')) as s:
+        parent = message_data('a', sent='2021-12-01T10:00:00.000Z', threadMessageCount=3)
+        threads = set()
+        for m in [parent] + make_thread('a', 3):
+            m = Message.new(dict(m, project='cloud-custodian/cloud-custodian'))
+            threads.add(update_thread(s, m))
+            s.add(m)
+        s.add(make_message('z', sent='2021-12-01T10:05:00.000Z', project='x'))
+        count_replies(s, threads)
+        s.commit()
+
+        assert [m.id for m in get_thread(s, 'a')] == ['a', 'a-000', 'a-001', 'a-002']
+        thread = s.get(Thread, 'a')
+        assert thread.reply_count == 3
+        assert thread.last_reply == parse('2021-12-01T11:00:02')
+
+
+def test_reply_count_partial_thread():
+    from sqlalchemy.orm import Session
+    from hubhud.gitter import Thread, count_replies, update_thread
+    from hubhud.schema import get_db
+
+    with Session(get_db('sqlite://')) as s:
+        parent = message_data('a', sent='2021-12-01T10:00:00.000Z', threadMessageCount=3)
+        # a commit lands after only part of the thread is stored
+        for m in [parent] + make_thread('a', 3)[:1]:
+            m = Message.new(dict(m, project='cloud-custodian/cloud-custodian'))
+            update_thread(s, m)
+            s.add(m)
+        count_replies(s, {'a'})
+        s.commit()
+        assert s.get(Thread, 'a').reply_count == 1
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+import time
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from hubhud.bulk import BulkLoader
+from hubhud.github import GithubEvent
+from hubhud.metrics import Events, backlog, metrics, reviewer_load, time_to_first_response
+from hubhud.schema import get_db
+
+from helpers import make_event
+
+
+T0 = datetime(2021, 1, 1)
+
+
+def hours(n):
+    return T0 + timedelta(hours=n)
+
+
+def test_lifecycle_metrics():
+    events = [
+        # issue 1 opened by a, self comment, then response from b after 2h, closed
+        make_event('a', hours(0), event_type='IssuesEvent', action='opened', number=1),
+        make_event('a', hours(1), event_type='IssueCommentEvent', action='created', number=1),
+        make_event('b', hours(2), event_type='IssueCommentEvent', action='created', number=1),
+        make_event('b', hours(24 * 40), event_type='IssuesEvent', action='closed', number=1),
+        # issue 2 never answered
+        make_event('c', hours(5), event_type='IssuesEvent', action='opened', number=2),
+        # pr 3 reviewed by b after 4h and c, merged after 10h
+        make_event('a', hours(0), event_type='PullRequestEvent', action='opened', number=3),
+        make_event('b', hours(4), event_type='PullRequestReviewEvent', action='created',
+                   number=3),
+        make_event('c', hours(6), event_type='PullRequestReviewCommentEvent',
+                   action='created', number=3),
+        make_event('b', hours(7), event_type='PullRequestReviewCommentEvent',
+                   action='created', number=3),
+        make_event('b', hours(10), event_type='PullRequestEvent', action='closed', number=3,
+                   merged_at=hours(10)),
+        # pr 4 reviewed by b, closed without merge, clickhouse's unset merged_at
+        make_event('c', hours(1), event_type='PullRequestEvent', action='opened', number=4),
+        make_event('b', hours(3), event_type='PullRequestReviewEvent', action='created',
+                   number=4),
+        make_event('c', hours(8), event_type='PullRequestEvent', action='closed', number=4,
+                   merged_at=datetime(1970, 1, 1)),
+    ]
+    with Session(get_db('sqlite://')) as s:
+        loader = BulkLoader(s, GithubEvent)
+        for e in events:
+            loader.add(e)
+        loader.flush()
+        s.commit()
+        results = metrics(s, 'cloud-custodian/cloud-custodian')
+
+    assert results['events'] == len(events)
+    issues = results['time_to_first_response']['issues']
+    assert (issues['count'], issues['p50'], issues['unanswered']) == (1, 2.0, 1)
+    pulls = results['time_to_first_response']['pulls']
+    assert (pulls['count'], pulls['p50'], pulls['unanswered']) == (2, 3.0, 0)
+    assert results['time_to_merge']['count'] == 1
+    assert results['time_to_merge']['p50'] == 10.0
+    assert results['backlog'] == [{'month': '2021-01', 'open': 2},
+                                  {'month': '2021-02', 'open': 1}]
+    load = results['reviewer_load']
+    assert load['top'] == [{'login': 'b', 'reviews': 2}, {'login': 'c', 'reviews': 1}]
+
+
+def test_backlog_since():
+    events = [
+        make_event('a', hours(0), event_type='IssuesEvent', action='opened', number=1),
+        make_event('a', hours(1), event_type='IssuesEvent', action='opened', number=2),
+        make_event('a', hours(2), event_type='IssuesEvent', action='opened', number=3),
+        make_event('b', hours(24 * 40), event_type='IssuesEvent', action='closed', number=1),
+        make_event('b', hours(24 * 41), event_type='IssuesEvent', action='closed', number=2),
+        make_event('a', hours(24 * 70), event_type='IssuesEvent', action='reopened',
+                   number=1),
+    ]
+    with Session(get_db('sqlite://')) as s:
+        s.add_all(events)
+        s.commit()
+        results = metrics(s, 'cloud-custodian/cloud-custodian', since=hours(24 * 35))
+    # seeded with the issues open before since
+    assert results['backlog'] == [{'month': '2021-02', 'open': 1},
+                                  {'month': '2021-03', 'open': 2}]
+
+
+def test_metrics_empty():
+    with Session(get_db('sqlite://')) as s:
+        results = metrics(s, 'cloud-custodian/cloud-custodian')
+    assert results['time_to_merge'] == {'count': 0}
+    assert results['backlog'] == []
+
+
+def test_metrics_scale():
+    # a 100k issue repository, with a comment per issue.
+    n = 100000
+    rng = np.random.default_rng(42)
+    opened = np.datetime64('2015-01-01T00:00:00') + rng.integers(0, 10**8, n).astype(
+        'timedelta64[s]')
+    rows = [('IssuesEvent', 'opened', i, t, 'user%d' % (i % 5000), None)
+            for i, t in enumerate(opened.tolist())]
+    rows += [('IssueCommentEvent', 'created', i, t + timedelta(hours=3), 'maint', None)
+             for i, t in enumerate(opened.tolist())]
+    rows += [('IssuesEvent', 'closed', i, t + timedelta(days=3), 'maint', None)
+             for i, t in enumerate(opened.tolist())]
+
+    t = time.time()
+    ev = Events(rows)
+    stats = time_to_first_response(ev, 'IssuesEvent')
+    backlog(ev)
+    reviewer_load(ev)
+    assert stats['count'] == n
+    assert stats['p50'] == 3.0
+    assert time.time() - t < 10
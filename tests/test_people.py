@@ -0,0 +1,53 @@
+from dataclasses import fields
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from hubhud import github
+from hubhud.github import GithubEvent, check_schema_diff
+from hubhud.people import People, get_person
+from hubhud.schema import get_db
+
+from helpers import make_event
+
+
+def test_people_observe():
+    with Session(get_db("sqlite://")) as s:
+        people = People(s)
+        pid = people.observe("KapilT", datetime(2021, 5, 1), messages=1)
+        assert people.observe("kapilt", datetime(2020, 1, 1), events=1) == pid
+        assert people.resolve("") is None
+        s.commit()
+
+        p = get_person(s, "KAPILT")
+        assert p.id == pid
+        assert (p.messages, p.events) == (1, 1)
+        assert (p.first_seen, p.last_seen) == (datetime(2020, 1, 1), datetime(2021, 5, 1))
+
+
+def test_github_sync_people(monkeypatch):
+    events = [
+        make_event("kapilt", datetime(2021, 1, 1), creator_user_login="ajkerrigan"),
+        make_event("ajkerrigan", datetime(2021, 1, 2), merged_by="kapilt"),
+        make_event("kapilt", datetime(2021, 1, 3)),
+    ]
+    monkeypatch.setattr(github, "get_events", lambda project, **kw: iter(events))
+
+    with Session(get_db("sqlite://")) as s:
+        assert github.sync(s, "cloud-custodian/cloud-custodian", None) == 3
+        kapilt, ajk = get_person(s, "kapilt"), get_person(s, "ajkerrigan")
+        assert kapilt.events == 2
+        assert ajk.events == 1
+        assert [e.actor_id for e in events] == [kapilt.id, ajk.id, kapilt.id]
+        assert events[0].creator_id == ajk.id
+        assert events[1].merged_by_id == kapilt.id
+
+
+def test_schema_diff_skips_local_fields():
+    schema = [
+        (f.name, "String")
+        for f in fields(GithubEvent)
+        if f.name not in GithubEvent.__local_fields__
+    ]
+    assert check_schema_diff(GithubEvent, schema) == [s[0] for s in schema]
+
@@ -0,0 +1,95 @@
+from datetime import datetime
+
+import sqlalchemy as rdb
+from sqlalchemy.orm import Session
+
+from hubhud.github import GithubEvent
+from hubhud.gitter import Message
+from hubhud.people import get_person
+from hubhud.schema import get_db, mapper_registry
+
+from helpers import make_event, make_message
+
+
+# columns and indexes added since the first release
+ADDED = {'author_id', 'actor_id', 'creator_id', 'merged_by_id'}
+
+
+def baseline_db(path, rows):
+    """Create a database with the original message and event tables."""
+    metadata = rdb.MetaData()
+    for model in (Message, GithubEvent):
+        rdb.Table(model.__tablename__, metadata, *[
+            rdb.Column(c.name, c.type, primary_key=c.primary_key)
+            for c in model.__table__.columns if c.name not in ADDED])
+    engine = rdb.create_engine('sqlite:///%s' % path)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        for table, values in rows:
+            conn.execute(metadata.tables[table].insert(), values)
+    engine.dispose()
+
+
+def row(obj):
+    return {c.name: getattr(obj, c.name, None) for c in obj.__table__.columns
+            if c.name not in ADDED and getattr(obj, c.name, None) is not None}
+
+
+def test_upgrade_baseline_db(tmp_path):
+    path = tmp_path / 'hud.db'
+    messages = [make_message('m%d' % i, sent='2021-12-0%dT10:00:00Z' % (i + 1),
+                             fromUser={'username': author})
+                for i, author in enumerate(['kapilt', 'KapilT', 'ajkerrigan'])]
+    event = make_event('ajkerrigan', datetime(2021, 1, 1), creator_user_login='jtroberts')
+    baseline_db(path, [('gitter_messages', [row(m) for m in messages]),
+                       ('github_event', [row(event)])])
+
+    engine = get_db('sqlite:///%s' % path)
+    inspector = rdb.inspect(engine)
+    for table in ('gitter_messages', 'github_event'):
+        assert {c['name'] for c in inspector.get_columns(table)} == {
+            c.name for c in mapper_registry.metadata.tables[table].columns}
+    assert {i['name'] for i in inspector.get_indexes('gitter_messages')} >= {
+        'ix_gitter_messages_author_id'}
+    assert {i['name'] for i in inspector.get_indexes('github_event')} >= {
+        'ix_github_event_actor_id'}
+
+    with Session(engine) as s:
+        kapilt, ajk = get_person(s, 'kapilt'), get_person(s, 'ajkerrigan')
+        assert (kapilt.messages, kapilt.events) == (2, 0)
+        assert (kapilt.first_seen, kapilt.last_seen) == (
+            datetime(2021, 12, 1, 10), datetime(2021, 12, 2, 10))
+        assert (ajk.messages, ajk.events) == (1, 1)
+        assert {m.author_id for m in s.query(Message) if m.author.lower() == 'kapilt'} == {
+            kapilt.id}
+        e = s.query(GithubEvent).one()
+        assert (e.actor_id, e.creator_id) == (ajk.id, get_person(s, 'jtroberts').id)
+
+    # the backfill is applied once
+    engine = get_db('sqlite:///%s' % path)
+    with Session(engine) as s:
+        assert get_person(s, 'kapilt').messages == 2
+
+
+def test_upgrade_thread_index(tmp_path):
+    path = tmp_path / 'hud.db'
+    baseline_db(path, [])
+    engine = get_db('sqlite:///%s' % path)
+    assert 'ix_gitter_messages_parent' in {
+        i['name'] for i in rdb.inspect(engine).get_indexes('gitter_messages')}
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            "explain query plan select * from gitter_messages where parent = 'a'").all()
+    assert 'ix_gitter_messages_parent' in str(plan)
+
+
+def test_upgrade_created_at_index(tmp_path):
+    path = tmp_path / 'hud.db'
+    baseline_db(path, [])
+    engine = get_db('sqlite:///%s' % path)
+    assert 'ix_github_event_created_at' in {
+        i['name'] for i in rdb.inspect(engine).get_indexes('github_event')}
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            'explain query plan select max(created_at) from github_event').all()
+    assert 'ix_github_event_created_at' in str(plan)
@@ -0,0 +1,88 @@
+import pytest
+import sqlalchemy as rdb
+from sqlalchemy.orm import Session
+
+from hubhud.gitter import Message
+from hubhud.schema import get_db
+from hubhud.search import get_shards, index, search
+
+from helpers import make_message
+
+
+def test_sharded_index_and_search(tmp_path):
+    with Session(get_db('sqlite://')) as s:
+        s.add_all([
+            make_message('a', 'how do i filter ec2 instances', '2020-05-01T10:00:00Z'),
+            make_message('b', 'ec2 filter on tags', '2021-05-01T10:00:00Z'),
+            make_message('c', 'ec2 ec2 ec2', '2021-06-01T10:00:00Z',
+                         project='kapilt/gittersearch'),
+        ])
+        s.commit()
+
+        assert index(s, tmp_path, by_year=True) == 3
+        assert [d.name for d in get_shards(tmp_path)] == [
+            'cloud-custodian__cloud-custodian@2020',
+            'cloud-custodian__cloud-custodian@2021',
+            'kapilt__gittersearch@2021']
+
+        results = search(tmp_path, 'ec2')
+        assert [r['doc']['id'][0] for r in results][0] == 'c'
+        assert sorted(r['doc']['id'][0] for r in results) == ['a', 'b', 'c']
+        assert [r['score'] for r in results] == sorted(
+            [r['score'] for r in results], reverse=True)
+
+        results = search(tmp_path, 'ec2', projects=['cloud-custodian/cloud-custodian'],
+                         years=[2021])
+        assert [r['doc']['id'][0] for r in results] == ['b']
+
+        # rebuilding one project leaves the other shards untouched
+        quiet = tmp_path / 'kapilt__gittersearch@2021'
+        before = {p.name for p in quiet.iterdir()}
+        s.add(make_message('d', 'ec2 again', '2021-07-01T10:00:00Z'))
+        s.commit()
+        assert index(s, tmp_path, projects=['cloud-custodian/cloud-custodian'],
+                     by_year=True) == 3
+        assert {p.name for p in quiet.iterdir()} == before
+        assert len(search(tmp_path, 'ec2', max_results=10)) == 4
+
+
+def test_reindex_removes_stale_shards(tmp_path):
+    with Session(get_db('sqlite://')) as s:
+        s.add_all([
+            make_message('a', 'ec2 filter', '2020-05-01T10:00:00Z'),
+            make_message('b', 'ec2 tags', '2021-05-01T10:00:00Z'),
+            make_message('c', 'ec2', '2021-06-01T10:00:00Z', project='kapilt/gittersearch'),
+        ])
+        s.commit()
+        index(s, tmp_path)
+
+        # changing layout replaces the project's unsharded index
+        assert index(s, tmp_path, projects=['cloud-custodian/cloud-custodian'],
+                     by_year=True) == 2
+        assert [d.name for d in get_shards(tmp_path)] == [
+            'cloud-custodian__cloud-custodian@2020',
+            'cloud-custodian__cloud-custodian@2021',
+            'kapilt__gittersearch']
+        assert len(search(tmp_path, 'ec2')) == 3
+
+        with pytest.raises(ValueError):
+            index(s, tmp_path, years=[2020])
+        # rebuilding some years of an unsharded project would drop the rest
+        with pytest.raises(ValueError):
+            index(s, tmp_path, projects=['kapilt/gittersearch'], years=[2021], by_year=True)
+        assert len(search(tmp_path, 'ec2')) == 3
+
+        # selected year shards without messages are cleared, others kept
+        s.execute(rdb.delete(Message).where(Message.id == 'a'))
+        s.commit()
+        assert index(s, tmp_path, projects=['cloud-custodian/cloud-custodian'],
+                     years=[2020], by_year=True) == 0
+        assert [d.name for d in get_shards(tmp_path)] == [
+            'cloud-custodian__cloud-custodian@2021', 'kapilt__gittersearch']
+
+        # projects whose messages are gone lose their shards on a full rebuild
+        s.execute(rdb.delete(Message).where(Message.id == 'c'))
+        s.commit()
+        index(s, tmp_path)
+        assert [d.name for d in get_shards(tmp_path)] == ['cloud-custodian__cloud-custodian']
+        assert [r['doc']['id'][0] for r in search(tmp_path, 'ec2')] == ['b']
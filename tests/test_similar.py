@@ -0,0 +1,83 @@
+import numpy as np
+from sqlalchemy.orm import Session
+
+from hubhud.schema import get_db
+from hubhud.similar import (
+    Bucket, MessageSignature, NumPerm, SimilarityIndex, bands, minhash, similarity)
+
+from helpers import make_message
+
+
+QUESTIONS = {
+    'q1': 'how do i filter ec2 instances by tag value in a policy',
+    'q2': 'how do i filter ec2 instances by tag value in my policy please',
+    'q3': 'the lambda mode policy fails to provision with an access denied error',
+    'q4': 'lambda mode policy fails to provision with access denied error',
+    'q5': 'is there a way to send notifications to slack from a policy',
+    'short': 'thanks!',
+}
+
+
+def test_minhash_similarity():
+    assert minhash('thanks!') is None
+    a, b, c = minhash(QUESTIONS['q1']), minhash(QUESTIONS['q2']), minhash(QUESTIONS['q5'])
+    assert similarity(a, a) == 1.0
+    assert similarity(a, b) > 0.5
+    assert similarity(a, c) < 0.2
+
+
+def test_similar_and_cluster():
+    with Session(get_db('sqlite://')) as s:
+        index = SimilarityIndex(s)
+        for mid, text in QUESTIONS.items():
+            m = make_message(mid, text)
+            s.add(m)
+            index.add(m)
+        reply = make_message('r1', 'you can use the value filter with tag keys', parentId='q1')
+        s.add(reply)
+        index.add(reply)
+        s.commit()
+
+        assert [r[0] for r in index.similar('q1')] == ['q2']
+        assert [r[0] for r in index.similar('q4')] == ['q3']
+        assert index.similar('q5') == []
+        assert index.similar('short') == []
+        assert index.cluster() == [['q1', 'q2'], ['q3', 'q4']]
+
+        # edits replace the message's buckets
+        index.add(make_message('q2', QUESTIONS['q5'] + ' today'))
+        s.commit()
+        assert [r[0] for r in index.similar('q5')] == ['q2']
+        assert s.query(Bucket).filter_by(message_id='q2').count() == 32
+
+
+def test_cluster_compares_all_bucket_pairs():
+    # a shares a bucket with b and c but is unlike either, b and c are alike.
+    c = np.ones(NumPerm, dtype=np.uint32)
+    c[:10] = 2
+    sigs = {'a': np.zeros(NumPerm, dtype=np.uint32), 'b': np.ones(NumPerm, dtype=np.uint32),
+            'c': c}
+    with Session(get_db('sqlite://')) as s:
+        for mid, sig in sigs.items():
+            s.add(MessageSignature(id=mid, project='x', signature=sig.tobytes()))
+            s.add(Bucket(band=0, bucket=1, message_id=mid))
+        s.commit()
+        assert SimilarityIndex(s).cluster() == [['b', 'c']]
+
+
+def test_cluster_exact_duplicates():
+    # bot boilerplate, all in the same buckets
+    sig = np.arange(NumPerm, dtype=np.uint32)
+    other = sig.copy()
+    other[:8] = 0
+    with Session(get_db('sqlite://')) as s:
+        index = SimilarityIndex(s)
+        for i in range(500):
+            s.add(MessageSignature(id='m%04d' % i, project='x', signature=sig.tobytes()))
+        s.add(MessageSignature(id='n', project='x', signature=other.tobytes()))
+        for mid, h in [('m%04d' % i, sig) for i in range(500)] + [('n', other)]:
+            s.add_all([Bucket(band=b, bucket=k, message_id=mid) for b, k in bands(h)])
+        s.commit()
+        clusters = index.cluster()
+    assert len(clusters) == 1
+    assert len(clusters[0]) == 501